@@ -186,6 +186,9 @@ class KristinaConfig(BaseSettings):
     embedding_cache_max_size: int = 20000
     response_cache_enabled: bool = True
     response_cache_ttl: int = 300
+    # SQLite: mmap (256MB) + страничный кэш (64MB) для read-heavy баз.
+    # Выключить на хостах с малым объёмом RAM
+    sqlite_memory_tuning: bool = True
 
     # ── Multi-Agent ──
     multi_agent_enabled: bool = True
@@ -21,17 +21,205 @@
 - В memory → emotional tagging при сохранении эпизодов
 """
 
+import re
 import time
-from collections import deque
-from typing import Dict, Optional
-from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
+from dataclasses import dataclass
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
 
 from utils.logging import get_logger
 
 logger = get_logger("emotions.vad")
 
+# Размер кольцевого буфера истории (для trajectory analysis)
+_HISTORY_SIZE = 500
+
+# Окно (сек), в котором повтор того же user_text считается дублем
+_DEDUP_WINDOW = 0.05
+
+# ── Лексикон эмоциональных сигналов ──
+# Единый источник — неизменяемые кортежи уровня модуля. Из них один раз
+# при импорте строятся: frozenset однословных ключей (пересечение с
+# множеством токенов текста) и regex для фраз, эмодзи и основ слов
+# (lookahead, чтобы перекрывающиеся фразы считались как раньше).
+_TOKEN_RE = re.compile(r"\w+")
+
+_POS_WORDS = (
+    "спасибо", "отлично", "круто", "молодец", "здорово",
+    "прекрасно", "замечательно", "👍", "❤", "🎉", "😊",
+    "работает", "получилось", "помогло", "ура",
+)
+_NEG_WORDS = (
+    "не работает", "плохо", "ужас", "бред", "глупо",
+    "неправильно", "фигня", "😡", "👎", "💩",
+    "не то", "опять", "почему не",
+)
+_GRAT_WORDS = ("спасибо", "молодец", "❤")
+_QUESTION_WORDS = ("как", "что", "почему", "зачем", "когда", "где", "кто")
+_URGENT_WORDS = ("срочно", "быстро", "немедленно")
+
+# Основы слов: ищутся как подстрока в любом месте текста, в том числе
+# внутри слова ("сломал" → "сломался", "баг" → "багов"). Сюда — корни
+# с богатым словоизменением; остальные ключи совпадают только целым токеном
+_POS_STEMS = ("супер", "класс")
+_NEG_STEMS = ("ошибк", "баг", "сломал")
+_GRAT_STEMS = ("благодар",)
+
+
+def _compile_lexicon(words: Tuple[str, ...], stems: Tuple[str, ...] = ()):
+    """Делит лексикон на (frozenset токенов, regex фраз/эмодзи/основ или None)"""
+    tokens = frozenset(w for w in words if _TOKEN_RE.fullmatch(w))
+    phrases = [w for w in words if w not in tokens] + list(stems)
+    if not phrases:
+        return tokens, None
+    return tokens, re.compile("(?=(" + "|".join(map(re.escape, phrases)) + "))")
+
+
+_POS_SET, _POS_PHRASE_RE = _compile_lexicon(_POS_WORDS, _POS_STEMS)
+_NEG_SET, _NEG_PHRASE_RE = _compile_lexicon(_NEG_WORDS, _NEG_STEMS)
+_GRAT_SET, _GRAT_PHRASE_RE = _compile_lexicon(_GRAT_WORDS, _GRAT_STEMS)
+_QWORD_SET = frozenset(_QUESTION_WORDS)
+_URGENT_SET = frozenset(_URGENT_WORDS)
+
+# Базовые стили ответа по эмоциональной метке
+_BASE_STYLES: Dict[str, Dict[str, object]] = {
+    "паника": {"tone": "urgent", "verbosity": "minimal", "emoji": False},
+    "тревога": {"tone": "careful", "verbosity": "concise", "emoji": False},
+    "печаль": {"tone": "soft", "verbosity": "concise", "emoji": False},
+    "отчаяние": {"tone": "honest", "verbosity": "minimal", "emoji": False},
+    "восторг": {"tone": "enthusiastic", "verbosity": "verbose", "emoji": True},
+    "радость": {"tone": "friendly", "verbosity": "normal", "emoji": True},
+    "спокойствие": {"tone": "calm", "verbosity": "normal", "emoji": False},
+    "дискомфорт": {"tone": "careful", "verbosity": "concise", "emoji": False},
+    "комфорт": {"tone": "warm", "verbosity": "normal", "emoji": True},
+    "нейтрально": {"tone": "neutral", "verbosity": "normal", "emoji": False},
+}
+
+_SITUATIONS = ("critical", "recovering", "declining", "thriving", "stable")
+
+# Предвычисленная таблица (label, situation) → стиль: O(1) lookup вместо
+# сборки dict на каждый вызов get_response_style()
+_STYLE_TABLE: Dict[Tuple[str, str], Mapping[str, object]] = {
+    (label, situation): MappingProxyType({
+        **base, "situation": situation, "emotional_label": label,
+    })
+    for label, base in _BASE_STYLES.items()
+    for situation in _SITUATIONS
+}
+
+
+# ═══════════════════════════════════════════════════════════════
+#                    ЧИСЛОВОЕ ЯДРО (шаги 2–8)
+# ═══════════════════════════════════════════════════════════════
+
+def _vad_step(valence: float, arousal: float, dominance: float,
+              sensitivity: float, cumulative_stress: float,
+              valence_baseline: float, arousal_baseline: float,
+              sentiment: float, gratitude: bool, is_question: bool,
+              urgency: float, response_quality: float,
+              had_errors: bool, error_streak: int, dt: float):
+    """
+    Один шаг обновления VAD: только скаляры на входе и выходе,
+    поэтому функция компилируется Numba без изменений.
+
+    Returns: (valence, arousal, dominance, raw_pain, raw_pleasure,
+              sensitivity, cumulative_stress, valence_baseline, arousal_baseline)
+    """
+    # === 2. Raw pain / pleasure ===
+    pain = 0.0
+    pleasure = 0.0
+
+    # Ошибки → боль
+    if had_errors:
+        pain += 0.3
+
+    # Негативные эмоции пользователя → эмпатическая боль
+    if sentiment < -0.3:
+        pain += abs(sentiment) * 0.2
+    elif sentiment > 0.3:
+        pleasure += sentiment * 0.3
+
+    # Благодарность → удовольствие
+    if gratitude:
+        pleasure += 0.4
+
+    # Стрик ошибок → нарастающая боль
+    if error_streak > 2:
+        pain += 0.1 * error_streak
+
+    raw_pain = min(pain, 1.0)
+    raw_pleasure = min(pleasure, 0.8)
+
+    # === 3. Valence (хорошо/плохо) ===
+    raw_valence = (pleasure - pain) + sentiment * 0.3 + response_quality * 0.2
+    raw_valence -= valence_baseline  # Hedonic adaptation
+
+    # === 4. Arousal (возбуждение) ===
+    question_boost = 0.1 if is_question else 0.0
+    urgency_boost = urgency * 0.2
+    error_arousal = 0.2 if had_errors else 0.0
+    surprise_arousal = 0.15 if gratitude else 0.0
+
+    raw_arousal = 0.3 + question_boost + urgency_boost + error_arousal + surprise_arousal
+
+    # === 5. Dominance (контроль) ===
+    raw_dominance = 0.5
+    if had_errors:
+        raw_dominance -= 0.15
+    if error_streak > 2:
+        raw_dominance -= 0.2
+    if response_quality > 0.5:
+        raw_dominance += 0.1
+
+    # === 6. Sensitivity (stress sensitization, из consciousness v0.7) ===
+    if valence < -0.3:
+        cumulative_stress += dt * abs(valence) * 0.01
+        sensitivity = min(sensitivity + 0.003, 1.4)
+    elif valence > 0.2:
+        cumulative_stress = max(cumulative_stress - dt * 0.005, 0.0)
+        sensitivity = max(sensitivity - 0.001, 0.7)
+
+    chronic_factor = 1.0 + min(cumulative_stress * 0.01, 0.3)
+
+    # === 7. Smoothing (инерция эмоций) ===
+    v_smooth = 0.7
+    a_smooth = 0.6
+    d_smooth = 0.8
+
+    valence = v_smooth * valence + (1 - v_smooth) * raw_valence * sensitivity * chronic_factor
+    arousal = a_smooth * arousal + (1 - a_smooth) * raw_arousal
+    dominance = d_smooth * dominance + (1 - d_smooth) * raw_dominance
 
-@dataclass
+    # Clamp
+    valence = max(-1.0, min(1.0, valence))
+    arousal = max(0.0, min(1.0, arousal))
+    dominance = max(0.0, min(1.0, dominance))
+
+    # === 8. Hedonic adaptation ===
+    valence_baseline += (valence - valence_baseline) * 0.003
+    arousal_baseline += (arousal - arousal_baseline) * 0.001
+
+    return (valence, arousal, dominance, raw_pain, raw_pleasure,
+            sensitivity, cumulative_stress, valence_baseline, arousal_baseline)
+
+
+if HAS_NUMBA:
+    _vad_step = njit(cache=True)(_vad_step)
+
+
+@dataclass(slots=True)
 class EmotionalState:
     """VAD + Pain/Pleasure"""
     valence: float = 0.0       # -1 (негатив) ... +1 (позитив)
@@ -87,9 +275,32 @@ class VADEmotionalEngine:
         self.sensitivity: float = 1.0
         self.cumulative_stress: float = 0.0
 
-        # History (для trajectory analysis)
-        self._history: deque = deque(maxlen=500)
+        # History (для trajectory analysis) — SoA кольцевой буфер:
+        # отдельный массив на каждое поле вместо deque из dict
+        if HAS_NUMPY:
+            self._hist_v = np.zeros(_HISTORY_SIZE, dtype=np.float64)
+            self._hist_a = np.zeros(_HISTORY_SIZE, dtype=np.float64)
+            self._hist_d = np.zeros(_HISTORY_SIZE, dtype=np.float64)
+            self._hist_t = np.zeros(_HISTORY_SIZE, dtype=np.float64)
+        else:
+            self._hist_v = [0.0] * _HISTORY_SIZE
+            self._hist_a = [0.0] * _HISTORY_SIZE
+            self._hist_d = [0.0] * _HISTORY_SIZE
+            self._hist_t = [0.0] * _HISTORY_SIZE
+        self._hist_i: int = 0  # Следующая позиция записи
+        self._hist_n: int = 0  # Сколько записей заполнено (≤ _HISTORY_SIZE)
         self._last_update: float = time.time()
+        self._last_user_hash: Optional[int] = None
+
+        # Кэши производных метрик. Ключ — счётчик записей в историю, а не
+        # _last_update: на грубых часах два обновления могут получить
+        # одинаковый time.time()
+        self._update_seq: int = 0
+        self._stats_cache: Optional[Tuple[int, Dict]] = None
+        self._traj_cache_seq: int = -1
+        self._traj_cache: Dict[int, float] = {}
+        self._sit_cache_seq: int = -1
+        self._sit_cache: str = "stable"
 
         # Streak tracking
         self._positive_streak: int = 0
@@ -106,6 +317,19 @@ class VADEmotionalEngine:
         Вызывается после каждого ответа.
         """
         now = time.time()
+
+        # Fast path: повторный вызов с тем же текстом (streaming/retry) —
+        # состояние не меняется, пропускаем анализ текста и EMA
+        user_hash = hash(user_text)
+        if (
+            user_hash == self._last_user_hash
+            and now - self._last_update < _DEDUP_WINDOW
+            and not had_errors
+        ):
+            self._last_update = now
+            return
+        self._last_user_hash = user_hash
+
         dt = min(now - self._last_update, 60.0)  # макс 60 сек
         self._last_update = now
 
@@ -113,101 +337,129 @@ class VADEmotionalEngine:
         user_signal = self._analyze_text_signals(user_text)
         response_quality = self._analyze_response_quality(response, had_errors)
 
-        # === 2. Raw pain / pleasure ===
-        pain = 0.0
-        pleasure = 0.0
+        # === 2–8. Состояние ===
+        self._apply_signals(user_signal, response_quality, had_errors, dt)
+
+        # === 9. History ===
+        self._push_history(self.state.valence, self.state.arousal, self.state.dominance, now)
+
+    def update_batch(self, turns: List[Tuple[str, str, bool]]):
+        """
+        Пакетное обновление по серии реплик (replay / обучение).
+
+        Эквивалентно последовательным вызовам update_from_dialogue()
+        без пауз между репликами: тексты анализируются одним проходом,
+        состояние обновляется в одном цикле, история пишется в кольцевой
+        буфер одной операцией. EMA здесь не линейна (sensitivity и
+        baseline зависят от состояния), поэтому рекуррентность остаётся
+        последовательной.
+
+        turns: [(user_text, response, had_errors), ...]
+        """
+        if not turns:
+            return
 
-        # Ошибки → боль
+        now = time.time()
+        dt = min(now - self._last_update, 60.0)
+        self._last_update = now
+        self._last_user_hash = hash(turns[-1][0])
+
+        signals = [self._analyze_text_signals(user_text) for user_text, _, _ in turns]
+        qualities = [
+            self._analyze_response_quality(response, had_errors)
+            for _, response, had_errors in turns
+        ]
+
+        n = len(turns)
+        valences = [0.0] * n
+        arousals = [0.0] * n
+        dominances = [0.0] * n
+        state = self.state
+        for k in range(n):
+            self._apply_signals(signals[k], qualities[k], turns[k][2], dt if k == 0 else 0.0)
+            valences[k] = state.valence
+            arousals[k] = state.arousal
+            dominances[k] = state.dominance
+
+        self._push_history_batch(valences, arousals, dominances, now)
+
+    def _apply_signals(self, user_signal: Dict, response_quality: float,
+                       had_errors: bool, dt: float):
+        """Шаги 2–8: стрики (Python) + числовое ядро _vad_step (Numba, если есть)"""
+        sentiment = user_signal["sentiment"]
+
+        # Стрики
         if had_errors:
-            pain += 0.3
             self._error_streak += 1
             self._positive_streak = 0
         else:
             self._error_streak = 0
 
-        # Негативные эмоции пользователя → эмпатическая боль
-        if user_signal["sentiment"] < -0.3:
-            pain += abs(user_signal["sentiment"]) * 0.2
+        if sentiment < -0.3:
             self._negative_streak += 1
             self._positive_streak = 0
-        elif user_signal["sentiment"] > 0.3:
-            pleasure += user_signal["sentiment"] * 0.3
+        elif sentiment > 0.3:
             self._positive_streak += 1
             self._negative_streak = 0
         else:
             self._positive_streak = 0
             self._negative_streak = 0
 
-        # Благодарность → удовольствие
-        if user_signal["gratitude"]:
-            pleasure += 0.4
-
-        # Стрик ошибок → нарастающая боль
-        if self._error_streak > 2:
-            pain += 0.1 * self._error_streak
-
-        self.state.raw_pain = min(pain, 1.0)
-        self.state.raw_pleasure = min(pleasure, 0.8)
-
-        # === 3. Valence (хорошо/плохо) ===
-        raw_valence = (pleasure - pain) + user_signal["sentiment"] * 0.3 + response_quality * 0.2
-        raw_valence -= self._valence_baseline  # Hedonic adaptation
-
-        # === 4. Arousal (возбуждение) ===
-        question_boost = 0.1 if user_signal["is_question"] else 0.0
-        urgency_boost = user_signal["urgency"] * 0.2
-        error_arousal = 0.2 if had_errors else 0.0
-        surprise_arousal = 0.15 if user_signal["gratitude"] else 0.0
-
-        raw_arousal = 0.3 + question_boost + urgency_boost + error_arousal + surprise_arousal
-
-        # === 5. Dominance (контроль) ===
-        raw_dominance = 0.5
-        if had_errors:
-            raw_dominance -= 0.15
-        if self._error_streak > 2:
-            raw_dominance -= 0.2
-        if response_quality > 0.5:
-            raw_dominance += 0.1
-
-        # === 6. Sensitivity (stress sensitization, из consciousness v0.7) ===
-        if self.state.valence < -0.3:
-            self.cumulative_stress += dt * abs(self.state.valence) * 0.01
-            self.sensitivity = min(self.sensitivity + 0.003, 1.4)
-        elif self.state.valence > 0.2:
-            self.cumulative_stress = max(self.cumulative_stress - dt * 0.005, 0.0)
-            self.sensitivity = max(self.sensitivity - 0.001, 0.7)
-
-        chronic_factor = 1.0 + min(self.cumulative_stress * 0.01, 0.3)
-
-        # === 7. Smoothing (инерция эмоций) ===
-        v_smooth = 0.7
-        a_smooth = 0.6
-        d_smooth = 0.8
-
-        self.state.valence = (
-            v_smooth * self.state.valence
-            + (1 - v_smooth) * raw_valence * self.sensitivity * chronic_factor
+        state = self.state
+        (
+            state.valence, state.arousal, state.dominance,
+            state.raw_pain, state.raw_pleasure,
+            self.sensitivity, self.cumulative_stress,
+            self._valence_baseline, self._arousal_baseline,
+        ) = _vad_step(
+            state.valence, state.arousal, state.dominance,
+            self.sensitivity, self.cumulative_stress,
+            self._valence_baseline, self._arousal_baseline,
+            sentiment, bool(user_signal["gratitude"]), bool(user_signal["is_question"]),
+            user_signal["urgency"], response_quality,
+            had_errors, self._error_streak, dt,
         )
-        self.state.arousal = a_smooth * self.state.arousal + (1 - a_smooth) * raw_arousal
-        self.state.dominance = d_smooth * self.state.dominance + (1 - d_smooth) * raw_dominance
-
-        # Clamp
-        self.state.valence = max(-1.0, min(1.0, self.state.valence))
-        self.state.arousal = max(0.0, min(1.0, self.state.arousal))
-        self.state.dominance = max(0.0, min(1.0, self.state.dominance))
 
-        # === 8. Hedonic adaptation ===
-        self._valence_baseline += (self.state.valence - self._valence_baseline) * 0.003
-        self._arousal_baseline += (self.state.arousal - self._arousal_baseline) * 0.001
+    # ═══════════════════════════════════════════════════════════
+    #                    ИСТОРИЯ (кольцевой буфер)
+    # ═══════════════════════════════════════════════════════════
 
-        # === 9. History ===
-        self._history.append({
-            "valence": self.state.valence,
-            "arousal": self.state.arousal,
-            "dominance": self.state.dominance,
-            "timestamp": now,
-        })
+    def _push_history(self, valence: float, arousal: float, dominance: float, ts: float):
+        i = self._hist_i
+        self._hist_v[i] = valence
+        self._hist_a[i] = arousal
+        self._hist_d[i] = dominance
+        self._hist_t[i] = ts
+        self._hist_i = (i + 1) % _HISTORY_SIZE
+        if self._hist_n < _HISTORY_SIZE:
+            self._hist_n += 1
+        self._update_seq += 1
+
+    def _push_history_batch(self, valences: List[float], arousals: List[float],
+                            dominances: List[float], ts: float):
+        # Записи старше последних _HISTORY_SIZE всё равно были бы перезаписаны:
+        # пропускаем их, но сдвигаем указатель так же, как при поштучной записи
+        skip = max(len(valences) - _HISTORY_SIZE, 0)
+        if skip:
+            valences = valences[skip:]
+            arousals = arousals[skip:]
+            dominances = dominances[skip:]
+            self._hist_i = (self._hist_i + skip) % _HISTORY_SIZE
+
+        if not HAS_NUMPY:
+            for v, a, d in zip(valences, arousals, dominances):
+                self._push_history(v, a, d, ts)
+            return
+
+        n = len(valences)
+        idx = (self._hist_i + np.arange(n)) % _HISTORY_SIZE
+        self._hist_v[idx] = valences
+        self._hist_a[idx] = arousals
+        self._hist_d[idx] = dominances
+        self._hist_t[idx] = ts
+        self._hist_i = (self._hist_i + n) % _HISTORY_SIZE
+        self._hist_n = min(self._hist_n + n, _HISTORY_SIZE)
+        self._update_seq += 1
 
     # ═══════════════════════════════════════════════════════════
     #                    АНАЛИЗ ТЕКСТА
@@ -216,30 +468,23 @@ class VADEmotionalEngine:
     def _analyze_text_signals(self, text: str) -> Dict:
         """Извлекает эмоциональные сигналы из текста пользователя"""
         lower = text.lower()
+        tokens = set(_TOKEN_RE.findall(lower))
 
-        # Sentiment
-        pos_words = ["спасибо", "отлично", "супер", "круто", "молодец", "класс",
-                     "здорово", "прекрасно", "замечательно", "👍", "❤", "🎉", "😊",
-                     "работает", "получилось", "помогло", "ура"]
-        neg_words = ["ошибка", "не работает", "плохо", "ужас", "бред", "глупо",
-                     "неправильно", "сломал", "баг", "фигня", "😡", "👎", "💩",
-                     "не то", "опять", "почему не"]
-
-        pos_count = sum(1 for w in pos_words if w in lower)
-        neg_count = sum(1 for w in neg_words if w in lower)
+        # Sentiment: однословные ключи — пересечение множеств,
+        # фразы/эмодзи/основы — один проход regex
+        pos_count = len(tokens & _POS_SET) + len(set(_POS_PHRASE_RE.findall(lower)))
+        neg_count = len(tokens & _NEG_SET) + len(set(_NEG_PHRASE_RE.findall(lower)))
         sentiment = (pos_count - neg_count) / max(pos_count + neg_count, 1)
 
         # Gratitude
-        gratitude = any(w in lower for w in ["спасибо", "благодар", "молодец", "❤"])
+        gratitude = not tokens.isdisjoint(_GRAT_SET) or _GRAT_PHRASE_RE.search(lower) is not None
 
         # Question
-        is_question = "?" in text or any(
-            w in lower for w in ["как", "что", "почему", "зачем", "когда", "где", "кто"]
-        )
+        is_question = "?" in text or not tokens.isdisjoint(_QWORD_SET)
 
         # Urgency
         urgency = 0.0
-        if any(w in lower for w in ["срочно", "быстро", "немедленно", "!!!"]):
+        if not tokens.isdisjoint(_URGENT_SET) or "!!!" in text:
             urgency = 0.8
         elif "!" in text:
             urgency = 0.3
@@ -266,35 +511,75 @@ class VADEmotionalEngine:
     # ═══════════════════════════════════════════════════════════
 
     def get_trajectory(self, window: int = 20) -> float:
-        """Тренд: улучшается или ухудшается ситуация?"""
-        if len(self._history) < window * 2:
-            return 0.0
-
-        recent = [h["valence"] for h in list(self._history)[-window:]]
-        older = [h["valence"] for h in list(self._history)[-window * 2:-window]]
+        """
+        Тренд: улучшается или ухудшается ситуация?
+        Кэшируется по window до следующего обновления состояния.
+        """
+        if self._traj_cache_seq != self._update_seq:
+            self._traj_cache_seq = self._update_seq
+            self._traj_cache = {}
+
+        traj = self._traj_cache.get(window)
+        if traj is None:
+            if self._hist_n < window * 2:
+                traj = 0.0
+            else:
+                traj = self._hist_mean(0, window) - self._hist_mean(window, 2 * window)
+            self._traj_cache[window] = traj
+        return traj
+
+    def _hist_mean(self, back_from: int, back_to: int) -> float:
+        """
+        Среднее valence по записям с отступом [back_from, back_to) от новейшей.
 
-        recent_avg = sum(recent) / len(recent)
-        older_avg = sum(older) / len(older)
+        Окно в кольцевом буфере — максимум два непрерывных среза
+        (для NumPy это view без копии), поэтому буфер целиком
+        никогда не материализуется.
+        """
+        lo = self._hist_i - back_to
+        hi = self._hist_i - back_from
+        if hi <= 0:
+            lo += _HISTORY_SIZE
+            hi += _HISTORY_SIZE
+
+        buf = self._hist_v
+        if lo >= 0:
+            segments = (buf[lo:hi],)
+        else:
+            segments = (buf[lo + _HISTORY_SIZE:], buf[:hi])
 
-        return recent_avg - older_avg
+        if HAS_NUMPY:
+            total = sum(float(seg.sum()) for seg in segments)
+        else:
+            total = sum(sum(seg) for seg in segments)
+        return total / (back_to - back_from)
 
     def get_situation_type(self) -> str:
         """
         Классификация ситуации (вдохновлено consciousness cortex).
+        Кэшируется до следующего обновления: get_stats и
+        get_response_style в одном ходе разделяют результат.
         """
+        if self._sit_cache_seq == self._update_seq:
+            return self._sit_cache
+
         traj = self.get_trajectory()
         v = self.state.valence
 
         if v < -0.4 and self._error_streak > 2:
-            return "critical"
+            situation = "critical"
         elif traj > 0.05:
-            return "recovering"
+            situation = "recovering"
         elif traj < -0.05:
-            return "declining"
+            situation = "declining"
         elif v > 0.3:
-            return "thriving"
+            situation = "thriving"
         else:
-            return "stable"
+            situation = "stable"
+
+        self._sit_cache_seq = self._update_seq
+        self._sit_cache = situation
+        return situation
 
     # ═══════════════════════════════════════════════════════════
     #                    ИНТЕРФЕЙС
@@ -314,35 +599,27 @@ class VADEmotionalEngine:
             return 0.7  # Устаёт медленнее
         return 1.0
 
-    def get_response_style(self) -> Dict[str, str]:
+    def get_response_style(self) -> Mapping[str, object]:
         """
         Стиль ответа на основе VAD (для prompt engineering).
 
         Вместо просто "настроение: neutral" → конкретные параметры.
+        Возвращает read-only mapping из предвычисленной таблицы
+        (10 меток × 5 ситуаций), поэтому ссылку можно разделять.
         """
-        label = self.state.label
-        situation = self.get_situation_type()
-
-        styles = {
-            "паника": {"tone": "urgent", "verbosity": "minimal", "emoji": False},
-            "тревога": {"tone": "careful", "verbosity": "concise", "emoji": False},
-            "печаль": {"tone": "soft", "verbosity": "concise", "emoji": False},
-            "отчаяние": {"tone": "honest", "verbosity": "minimal", "emoji": False},
-            "восторг": {"tone": "enthusiastic", "verbosity": "verbose", "emoji": True},
-            "радость": {"tone": "friendly", "verbosity": "normal", "emoji": True},
-            "спокойствие": {"tone": "calm", "verbosity": "normal", "emoji": False},
-            "дискомфорт": {"tone": "careful", "verbosity": "concise", "emoji": False},
-            "комфорт": {"tone": "warm", "verbosity": "normal", "emoji": True},
-            "нейтрально": {"tone": "neutral", "verbosity": "normal", "emoji": False},
-        }
-
-        style = styles.get(label, styles["нейтрально"])
-        style["situation"] = situation
-        style["emotional_label"] = label
-        return style
+        return _STYLE_TABLE[(self.state.label, self.get_situation_type())]
 
     def get_stats(self) -> Dict:
-        return {
+        """
+        Статистика для логов/телеметрии.
+        Кэшируется до следующего обновления состояния.
+        """
+        if self._stats_cache is not None and self._stats_cache[0] == self._update_seq:
+            return self._stats_cache[1]
+
+        # Скалярные round(): для 6 чисел np.round медленнее из-за создания
+        # массива и .tolist(); стоимость и так раз в ход благодаря кэшу
+        stats = {
             "state": {
                 "valence": round(self.state.valence, 3),
                 "arousal": round(self.state.arousal, 3),
@@ -353,10 +630,12 @@ class VADEmotionalEngine:
             "cumulative_stress": round(self.cumulative_stress, 3),
             "trajectory": round(self.get_trajectory(), 4),
             "situation": self.get_situation_type(),
-            "history_size": len(self._history),
+            "history_size": self._hist_n,
             "streaks": {
                 "positive": self._positive_streak,
                 "negative": self._negative_streak,
                 "errors": self._error_streak,
             },
         }
+        self._stats_cache = (self._update_seq, stats)
+        return stats
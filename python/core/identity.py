@@ -2,17 +2,57 @@
 Движок личности (объединяет identity_engine и personality_evolution)
 """
 
+import copy
+import functools
+import re
 import yaml
 import json
 from pathlib import Path
 from datetime import datetime
 from typing import Dict, Any
 
+try:
+    import orjson
+
+    def _json_loads(data: bytes):
+        return orjson.loads(data)
+
+    def _json_dumps_pretty(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+except ImportError:
+    def _json_loads(data: bytes):
+        return json.loads(data)
+
+    def _json_dumps_pretty(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+
 from utils.logging import get_logger
 import config
 
 logger = get_logger("identity")
 
+
+# Кэш разобранных файлов личности: ключ включает mtime, поэтому
+# изменённый на диске файл перечитывается автоматически
+@functools.lru_cache(maxsize=32)
+def _read_yaml_cached(path_str: str, mtime_ns: int) -> Dict:
+    with open(path_str, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f)
+
+
+@functools.lru_cache(maxsize=32)
+def _read_json_cached(path_str: str, mtime_ns: int) -> Dict:
+    with open(path_str, 'rb') as f:
+        return _json_loads(f.read())
+
+
+# Порог срабатывания адаптации (число взаимодействий)
+_EVOLUTION_THRESHOLD = 15
+
+# Технические слова (подстрочный поиск, как и раньше: "кода", "классы" тоже)
+_TECH_RE = re.compile(r"api|функция|код|процесс|алгоритм|класс", re.IGNORECASE)
+
+
 class IdentityEngine:
     """Управление личностью и эволюцией"""
     
@@ -34,29 +74,42 @@ class IdentityEngine:
         self.conversation_depth = 0
         
         # Счётчики паттернов (для эволюции)
-        self.interaction_patterns = {
-            'user_prefers_short': 0,
-            'user_prefers_detailed': 0,
-            'user_technical': 0
+        self._pref_short = 0
+        self._pref_detailed = 0
+        self._tech_count = 0
+        
+        # Уже применённые адаптации: после применения проверка не нужна
+        applied = self.evolution_data.get('adaptations', {})
+        self._adaptations_locked = {
+            'prefers_brevity': 'prefers_brevity' in applied,
+            'technical_user': 'technical_user' in applied,
         }
         
         logger.info("🧠 Личность загружена")
         self._print_identity_summary()
     
+    @property
+    def interaction_patterns(self) -> Dict[str, int]:
+        """Счётчики паттернов взаимодействия (read-only снимок)"""
+        return {
+            'user_prefers_short': self._pref_short,
+            'user_prefers_detailed': self._pref_detailed,
+            'user_technical': self._tech_count,
+        }
+    
     def _load_yaml(self, filename: str) -> Dict:
         """Загрузка YAML"""
         path = self.identity_dir / filename
         if path.exists():
-            with open(path, 'r', encoding='utf-8') as f:
-                return yaml.safe_load(f)
+            # deepcopy: вызывающий код мутирует dict, кэш должен остаться чистым
+            return copy.deepcopy(_read_yaml_cached(str(path), path.stat().st_mtime_ns))
         return {}
     
     def _load_json(self, filename: str) -> Dict:
         """Загрузка JSON"""
         path = self.identity_dir / filename
         if path.exists():
-            with open(path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            return copy.deepcopy(_read_json_cached(str(path), path.stat().st_mtime_ns))
         return {}
     
     def _print_identity_summary(self):
@@ -107,36 +160,41 @@ class IdentityEngine:
     def analyze_interaction(self, user_input: str, response: str):
         """Анализирует взаимодействие для эволюции"""
         
-        # Длина предпочтений
-        if len(user_input.split()) < 10:
-            self.interaction_patterns['user_prefers_short'] += 1
+        # Длина предпочтений (приблизительный подсчёт слов без split())
+        if user_input.count(" ") + 1 < 10:
+            self._pref_short += 1
         else:
-            self.interaction_patterns['user_prefers_detailed'] += 1
+            self._pref_detailed += 1
         
         # Технический уровень
-        tech_words = ['api', 'функция', 'код', 'процесс', 'алгоритм', 'класс']
-        if any(w in user_input.lower() for w in tech_words):
-            self.interaction_patterns['user_technical'] += 1
-        
-        # Проверяем адаптации
-        self._check_evolution()
+        if _TECH_RE.search(user_input):
+            self._tech_count += 1
+        
+        # Проверяем адаптации — только если какой-то счётчик за порогом,
+        # а его адаптация ещё не применена (иначе проверка — no-op)
+        locked = self._adaptations_locked
+        if (
+            (self._pref_short > _EVOLUTION_THRESHOLD and not locked['prefers_brevity'])
+            or (self._tech_count > _EVOLUTION_THRESHOLD and not locked['technical_user'])
+        ):
+            self._check_evolution()
     
     def _check_evolution(self):
         """Проверяет необходимость эволюции"""
         
-        threshold = 15
+        locked = self._adaptations_locked
         
         # Краткость
-        if self.interaction_patterns['user_prefers_short'] > threshold:
-            if 'prefers_brevity' not in self.evolution_data.get('adaptations', {}):
+        if self._pref_short > _EVOLUTION_THRESHOLD:
+            if not locked['prefers_brevity']:
                 self._apply_adaptation(
                     'prefers_brevity',
                     'Пользователь предпочитает краткие ответы'
                 )
         
         # Технический стиль
-        if self.interaction_patterns['user_technical'] > threshold:
-            if 'technical_user' not in self.evolution_data.get('adaptations', {}):
+        if self._tech_count > _EVOLUTION_THRESHOLD:
+            if not locked['technical_user']:
                 self._apply_adaptation(
                     'technical_user',
                     'Пользователь технически подкован'
@@ -147,28 +205,30 @@ class IdentityEngine:
         
         logger.info(f"🔄 Эволюция: {reason}")
         
+        ts = datetime.now().isoformat()
+        
         if 'changes' not in self.evolution_data:
             self.evolution_data['changes'] = []
         if 'adaptations' not in self.evolution_data:
             self.evolution_data['adaptations'] = {}
         
         self.evolution_data['changes'].append({
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': ts,
             'adaptation_id': adaptation_id,
             'reason': reason
         })
         
         self.evolution_data['adaptations'][adaptation_id] = {
-            'applied': datetime.now().isoformat()
+            'applied': ts
         }
+        self._adaptations_locked[adaptation_id] = True
         
         self._save_evolution()
     
     def _save_evolution(self):
-        """Сохраняет эволюцию"""
+        """Сохраняет эволюцию (orjson ~5x быстрее stdlib json)"""
         try:
-            with open(self.evolution_file, 'w', encoding='utf-8') as f:
-                json.dump(self.evolution_data, f, ensure_ascii=False, indent=2)
+            self.evolution_file.write_bytes(_json_dumps_pretty(self.evolution_data))
         except Exception as e:
             logger.error(f"Ошибка сохранения эволюции: {e}")
     
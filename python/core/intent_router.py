@@ -18,12 +18,239 @@ v7.4:
 
 import re
 import math
-from typing import Optional, Dict, List, Any
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List, Any, Union
 
 from utils.logging import get_logger
 
+try:
+    import ahocorasick
+    HAS_AHOCORASICK = True
+except ImportError:
+    HAS_AHOCORASICK = False
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+try:
+    from numba import njit
+    HAS_NUMBA = HAS_NUMPY
+except ImportError:
+    HAS_NUMBA = False
+
+try:
+    import simsimd
+    HAS_SIMSIMD = HAS_NUMPY
+except ImportError:
+    HAS_SIMSIMD = False
+
 logger = get_logger("intent_router")
 
+# Эмбеддинг запроса: список float (SentenceEmbeddings.encode) или
+# np.ndarray float32 — он проходит в EmbeddingClassifier без копии
+Embedding = Union[List[float], "np.ndarray"]
+
+# Валюта из запроса (в нижнем регистре) → ISO-код; ключи = альтернация
+# экстрактора get_currency_rate
+_CURRENCY_MAP = {
+    "доллар": "USD", "евро": "EUR", "юан": "CNY", "фунт": "GBP",
+    "usd": "USD", "eur": "EUR", "cny": "CNY", "gbp": "GBP", "jpy": "JPY",
+}
+
+# Intent-ы, у которых единственный rule-слот — имя файла
+_FILEPATH_INTENTS = frozenset({
+    "read_file", "delete_file", "write_file", "append_file", "file_info",
+})
+
+# Intent-ы director-а, которые не обязаны быть инструментами (Tier 2.5)
+_DIRECTOR_INTENTS = frozenset({"greeting", "explanation", "creative"})
+
+# Размер LRU-кэшей результатов route() и learned-слотов
+_ROUTE_CACHE_SIZE = 1024
+_SLOTS_CACHE_SIZE = 1024
+
+
+# ═══════════════════════════════════════════════════════════════
+# Триггеры Tier-2 правил
+# ═══════════════════════════════════════════════════════════════
+# intent → подстроки (в нижнем регистре), хотя бы одна из которых
+# ОБЯЗАНА быть во входе, если правило сработало. Это необходимое условие:
+# триггер должен покрывать КАЖДУЮ альтернативу regex-а, иначе префильтр
+# теряет совпадения. Проверяется по _RULE_EXAMPLES при построении индекса.
+# Правило без записи здесь проверяется всегда.
+_RULE_TRIGGERS: Dict[str, tuple] = {
+    "create_file": ("создай", "сделай", "напиши", "сгенерируй"),
+    "delete_file": ("удали", "убери", "сотри"),
+    "read_file": ("прочитай", "прочти", "открой", "покажи", "что"),
+    "append_file": ("запиши", "допиши", "добавь"),
+    "copy_file": ("скопируй", "копируй", "копировать"),
+    "move_file": ("перемести", "перенеси", "перемещ"),
+    "rename_file": ("переименуй", "переименовать"),
+    "list_directory": ("покажи", "список", "что"),
+    "create_directory": ("создай", "сделай"),
+    "search_files": ("найди", "поищи", "поиск"),
+    "file_info": ("информаци", "размер", "вес", "дата"),
+    "archive": ("заархивируй", "упакуй", "архив"),
+    "launch_app": ("запусти", "открой", "включи"),
+    "kill_process": ("закрой", "заверши", "убей", "останови"),
+    "system_status": ("статус", "состояние", "нагрузка"),
+    "system_info": ("информаци", "инфо"),
+    "list_processes": ("процесс", "запущенные"),
+    "disk_usage": ("мест", "дисков", "свободн"),
+    "run_command": ("выполни", "терминал", "командн"),
+    "get_current_time": ("врем", "час", "какой"),
+    "get_weather": ("погод", "температур", "градус", "улице"),
+    "get_currency_rate": ("курс", "стоимость"),
+    "recall_memory": ("вспомни", "напомни", "помнишь", "знаешь"),
+    "save_note": ("сохрани", "запиши", "запомни"),
+    "list_notes": ("покажи", "список"),
+    "web_search": ("найди", "поищи", "загугли", "погугли", "search",
+                   "что", "кто"),
+    "download_file": ("скачай", "загрузи", "download"),
+    "greeting": ("привет", "здравствуй", "хай", "hello", "добр", "дела"),
+    "explanation": ("расскажи", "объясни", "почему", "зачем", "работает"),
+    "creative": ("придумай", "сочини", "напиши"),
+    "self_awareness": ("ты", "тебя"),
+    "capabilities": ("умеешь", "можешь", "способн"),
+    "smalltalk": ("как", "нов"),
+}
+
+# intent → входы (в нижнем регистре), по одному на каждую альтернативу
+# regex-а правила. Правило, чей regex совпал с примером без единого
+# триггера, префильтр не отбрасывает (см. _build_trigger_index)
+_RULE_EXAMPLES: Dict[str, tuple] = {
+    "create_file": ("создай файл", "сделай новый документ",
+                    "напиши текстовый файл", "сгенерируй текст"),
+    "delete_file": ("удали файл", "убери этот документ", "сотри файл",
+                    "удалить файл"),
+    "read_file": ("прочитай файл", "прочти документ", "открой файле",
+                  "покажи файла", "что в файле"),
+    "append_file": ("запиши в файл", "допиши к документу", "добавь в файл"),
+    "copy_file": ("скопируй файл", "копируй документ", "копировать файл"),
+    "move_file": ("перемести файл", "перенеси документ", "перемещ файл"),
+    "rename_file": ("переименуй файл", "переименовать документ"),
+    "list_directory": ("покажи папку", "список директории",
+                       "что в каталоге", "покажи рабочем столе"),
+    "create_directory": ("создай папку", "сделай директорию",
+                         "создай каталог"),
+    "search_files": ("найди файлы", "поищи файл", "поиск файла"),
+    "file_info": ("информация о файле", "размер файла", "вес файла",
+                  "дата файле"),
+    "archive": ("заархивируй", "упакуй это", "в архив"),
+    "launch_app": ("запусти браузер", "открой приложение телеграм",
+                   "запустить игру", "включи музыку"),
+    "kill_process": ("закрой процесс хром", "заверши приложение x",
+                     "убей процесс y", "останови приложение z"),
+    "system_status": ("статус системы", "состояние компьютера",
+                      "нагрузка пк"),
+    "system_info": ("информация о системе", "инфо компьютеру",
+                    "информацию о пк"),
+    "list_processes": ("процессы", "запущенные", "список процессов"),
+    "disk_usage": ("место на диске", "дисковое", "свободно на диске"),
+    "run_command": ("выполни команду", "открой терминал",
+                    "командная строка"),
+    "get_current_time": ("время", "который час", "сколько времени",
+                         "какой сегодня день", "какой день", "час"),
+    "get_weather": ("погода", "температура", "сколько градусов",
+                    "что на улице"),
+    "get_currency_rate": ("курс доллара", "стоимость евро", "курс валют",
+                          "курс рубля", "курс юаня", "курс фунта",
+                          "курс usd", "курс eur", "курс cny", "курс gbp"),
+    "recall_memory": ("вспомни", "напомни", "помнишь", "что ты знаешь",
+                      "что знаешь"),
+    "save_note": ("сохрани заметку", "запиши замечание", "запомни заметку"),
+    "list_notes": ("покажи заметки", "список заметок"),
+    "web_search": ("найди рецепт", "поищи", "загугли", "погугли", "search",
+                   "что такое ии", "что значит слово", "кто такой он",
+                   "кто такая она"),
+    "download_file": ("скачай с сайта", "загрузи файл из сети",
+                      "download по ссылке"),
+    "greeting": ("привет", "здравствуй", "хай", "hello", "доброе утро",
+                 "добрый день", "добрый вечер", "как дела"),
+    "explanation": ("расскажи", "объясни", "почему", "зачем",
+                    "как работает"),
+    "creative": ("придумай", "сочини", "напиши стих", "напиши рассказ",
+                 "напиши историю", "напиши пожелание",
+                 "напиши поздравление"),
+    "self_awareness": ("ты осознаёшь", "ты себя осознаешь", "ты живая",
+                       "ты живой", "ты настоящая", "ты реальна", "ты робот",
+                       "кто ты", "что ты такое", "ты чувствуешь",
+                       "ты думаешь", "у тебя есть сознание",
+                       "у тебя чувства", "ты человек", "что ты о себе",
+                       "как ты думаешь о себе", "ты можешь мечтать"),
+    "capabilities": ("что ты умеешь", "что можешь", "что ты способна",
+                     "на что ты способна", "чего ты можешь"),
+    "smalltalk": ("как ты", "как у тебя", "как твои дела", "как поживаешь",
+                  "как настроение", "что нового", "как нового",
+                  "что новенького", "как новенького", "как чувствуешь",
+                  "как себя чувствуешь"),
+}
+
+
+def _lower(text: str) -> str:
+    """
+    str.lower() с сохранением длины: позиции совпадений в результате
+    совпадают с позициями в исходной строке (см. IntentRouter._group).
+    """
+    low = text.lower()
+    if len(low) == len(text):
+        return low
+    # 'İ'.lower() — два символа; такие оставляем как есть
+    return "".join(ch if len(ch.lower()) != 1 else ch.lower() for ch in text)
+
+
+def _ac_scan(cps, cp_class, delta, out) -> int:
+    """
+    Проход DFA Ахо-Корасик по кодовым точкам строки (см. _compile_trigger_dfa).
+
+    cp_class[cp] — класс символа (0 — символа нет ни в одном триггере),
+    delta[state, class] — переход с уже развёрнутыми fail-ссылками,
+    out[state] — битовая маска правил, чей триггер заканчивается здесь.
+    """
+    state = 0
+    mask = 0
+    n_classes = cp_class.shape[0]
+    for i in range(cps.shape[0]):
+        cp = cps[i]
+        c = cp_class[cp] if cp < n_classes else 0
+        state = delta[state, c]
+        mask |= out[state]
+    return mask
+
+
+def _best_row(matrix, query) -> tuple:
+    """
+    Строка матрицы нормированных центроидов с наибольшим косинусом к query.
+
+    Норма запроса, скалярные произведения и argmax — за один проход,
+    без промежуточных массивов (см. EmbeddingClassifier._classify_matrix).
+    """
+    norm_q = 0.0
+    for j in range(query.shape[0]):
+        norm_q += query[j] * query[j]
+    norm_q = math.sqrt(norm_q) + 1e-10
+    best_i = 0
+    best_dot = -math.inf
+    for i in range(matrix.shape[0]):
+        dot = 0.0
+        for j in range(query.shape[0]):
+            dot += matrix[i, j] * query[j]
+        if dot > best_dot:
+            best_dot = dot
+            best_i = i
+    return best_i, best_dot / norm_q
+
+
+if HAS_NUMBA:
+    _ac_scan = njit(cache=True)(_ac_scan)
+    _best_row = njit(cache=True, fastmath=True)(_best_row)
+
 
 class EmbeddingClassifier:
     """
@@ -31,58 +258,112 @@ class EmbeddingClassifier:
 
     Хранит центроиды (средние эмбеддинги) для каждого intent-а.
     При классификации считает cosine similarity с каждым центроидом.
+
+    Вместо среднего хранится сумма примеров и их число: косинус не
+    зависит от масштаба, поэтому делить сумму на count не нужно, а
+    add_example сводится к одному векторному сложению.
+
+    theta < 1 — коэффициент забывания: sum = theta·sum + x, так что
+    старые примеры intent-а весят theta^k и центроид следует за
+    дрейфом формулировок. По умолчанию 1.0 — все примеры равноценны.
+
+    Суммы хранятся как np.float32 (при наличии numpy) и для
+    classify собираются в одну матрицу [K, D] с L2-нормированными
+    строками: вместо цикла по intent-ам — один проход Numba-ядра
+    _best_row, simsimd.cdist или BLAS-умножение матрицы на
+    нормированный запрос и argmax.
+    add_example по известному intent-у перенормирует только его строку;
+    новый intent помечает матрицу устаревшей, и она лениво
+    пересобирается при следующем classify.
+    Без numpy — прежние списки и чистый Python.
     """
 
-    def __init__(self, similarity_threshold: float = 0.72):
+    def __init__(self, similarity_threshold: float = 0.72, theta: float = 1.0):
         self._threshold = similarity_threshold
-        # intent → {"centroid": [...], "count": N, "agent": "..."}
+        self._theta = theta
+        # intent → {"sum": np.ndarray | [...], "count": N, "agent": "..."}
         self._centroids: Dict[str, Dict] = {}
         self._total_classified = 0
-
-    def add_example(self, intent: str, agent: str, embedding: List[float]):
+        # Нормированные центроиды [K, D], intent-ы по строкам и
+        # обратный индекс; None — матрица устарела (новый intent)
+        self._matrix = None
+        self._matrix_intents: List[str] = []
+        self._matrix_rows: Dict[str, int] = {}
+        # classify может идти в потоке IntentRouter.route_async,
+        # пока learn_from_route дообучает центроиды в event loop
+        self._lock = threading.Lock()
+        if HAS_NUMBA:
+            # Прогрев JIT (или загрузка из кэша) на тех же типах, чтобы
+            # компиляцию не платил первый запрос Tier 2.5
+            _best_row(np.ones((1, 2), dtype=np.float32), np.ones(2, dtype=np.float32))
+
+    def add_example(self, intent: str, agent: str, embedding: Embedding):
         """Добавляет пример для обучения центроида"""
-        if not embedding or all(v == 0 for v in embedding):
+        # any() останавливается на первом ненулевом — и для ndarray
+        if embedding is None or len(embedding) == 0 or not any(embedding):
             return
 
+        vec = self._as_vector(embedding)
+        with self._lock:
+            self._add_vector(intent, agent, vec)
+
+    def _add_vector(self, intent: str, agent: str, vec):
         if intent not in self._centroids:
             self._centroids[intent] = {
-                "centroid": list(embedding),
+                # Копия: сумма дальше меняется на месте
+                "sum": vec.copy(),
                 "count": 1,
                 "agent": agent,
             }
         else:
             c = self._centroids[intent]
-            n = c["count"]
-            # Инкрементальное обновление центроида: running average
-            c["centroid"] = [
-                (old * n + new) / (n + 1)
-                for old, new in zip(c["centroid"], embedding)
-            ]
-            c["count"] = n + 1
+            theta = self._theta
+            if HAS_NUMPY:
+                if theta != 1.0:
+                    c["sum"] *= theta
+                c["sum"] += vec
+                if self._matrix is not None:
+                    self._matrix[self._matrix_rows[intent]] = self._unit(c["sum"])
+            else:
+                c["sum"] = [theta * old + new for old, new in zip(c["sum"], vec)]
+            c["count"] += 1
+            return
+        self._matrix = None
 
-    def classify(self, embedding: List[float]) -> Optional[Dict[str, Any]]:
+    def classify(self, embedding: Embedding) -> Optional[Dict[str, Any]]:
         """
         Классифицирует по cosine similarity с центроидами.
 
         Returns:
             Dict с intent/agent/confidence или None
         """
-        if not embedding or not self._centroids:
+        if embedding is None or len(embedding) == 0 or not self._centroids:
             return None
 
-        best_intent = None
-        best_sim = -1.0
-        best_agent = "director"
-
-        for intent, data in self._centroids.items():
-            sim = self._cosine_similarity(embedding, data["centroid"])
-            if sim > best_sim:
-                best_sim = sim
-                best_intent = intent
-                best_agent = data["agent"]
-
-        if best_sim >= self._threshold and best_intent:
-            self._total_classified += 1
+        embedding = self._as_vector(embedding)
+        with self._lock:
+            if HAS_NUMPY:
+                best_intent, best_sim = self._classify_matrix(embedding)
+                best_agent = self._centroids[best_intent]["agent"]
+            else:
+                best_intent = None
+                best_sim = -1.0
+                best_agent = "director"
+
+                for intent, data in self._centroids.items():
+                    sim = self._cosine_similarity(embedding, data["sum"])
+                    if sim > best_sim:
+                        best_sim = sim
+                        best_intent = intent
+                        best_agent = data["agent"]
+
+            hit = best_sim >= self._threshold and best_intent
+            if hit:
+                # Под тем же lock, что и поиск: += не атомарен между
+                # потоком route_async и event loop
+                self._total_classified += 1
+
+        if hit:
             return {
                 "intent": best_intent,
                 "agent": best_agent,
@@ -94,6 +375,48 @@ class EmbeddingClassifier:
 
         return None
 
+    @staticmethod
+    def _as_vector(embedding):
+        """
+        Вектор во внутреннем формате: np.float32 или список.
+        np.ndarray(float32) проходит без копии.
+        """
+        if HAS_NUMPY:
+            return np.asarray(embedding, dtype=np.float32)
+        return list(embedding)
+
+    def _rebuild_matrix(self):
+        """Собирает матрицу нормированных центроидов [K, D]"""
+        self._matrix_intents = list(self._centroids)
+        self._matrix_rows = {intent: i for i, intent in enumerate(self._matrix_intents)}
+        m = np.vstack([self._centroids[i]["sum"] for i in self._matrix_intents])
+        m /= np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-10)
+        self._matrix = m
+
+    @staticmethod
+    def _unit(vec):
+        """L2-нормированная копия вектора (строка матрицы центроидов)"""
+        return vec / max(float(np.linalg.norm(vec)), 1e-10)
+
+    def _classify_matrix(self, query) -> tuple:
+        """Лучший intent и его similarity за один проход по матрице"""
+        if self._matrix is None:
+            self._rebuild_matrix()
+        if HAS_NUMBA:
+            i, sim = _best_row(self._matrix, query)
+            return self._matrix_intents[i], float(sim)
+        if HAS_SIMSIMD:
+            # Косинусное расстояние до всех строк сразу; для нулевого
+            # запроса — 1.0, т.е. similarity 0.0
+            sims = 1.0 - np.asarray(
+                simsimd.cdist(query[None, :], self._matrix, metric="cosine")
+            )[0]
+        else:
+            # Строки уже нормированы — достаточно нормировать запрос
+            sims = self._matrix @ (query / (np.linalg.norm(query) + 1e-10))
+        i = int(sims.argmax())
+        return self._matrix_intents[i], float(sims[i])
+
     @staticmethod
     def _cosine_similarity(a: List[float], b: List[float]) -> float:
         """Cosine similarity между двумя векторами"""
@@ -105,11 +428,12 @@ class EmbeddingClassifier:
         return dot / (norm_a * norm_b)
 
     def get_stats(self) -> Dict:
-        return {
-            "intents": len(self._centroids),
-            "total_classified": self._total_classified,
-            "examples": {k: v["count"] for k, v in self._centroids.items()},
-        }
+        with self._lock:
+            return {
+                "intents": len(self._centroids),
+                "total_classified": self._total_classified,
+                "examples": {k: v["count"] for k, v in self._centroids.items()},
+            }
 
 
 class IntentRouter:
@@ -120,6 +444,9 @@ class IntentRouter:
     Tier 3: LLM fallback
     """
 
+    # Заполняется _build_rules() один раз на класс
+    _rules: Optional[List[tuple]] = None
+
     def __init__(self, learned_patterns, tool_names: List[str] = None,
                  sentence_embeddings=None):
         """
@@ -129,193 +456,213 @@ class IntentRouter:
             sentence_embeddings: SentenceEmbeddings для Tier 2.5
         """
         self.learned = learned_patterns
-        self.tool_names = set(tool_names or [])
+        # frozenset: только проверки «in» на горячем пути
+        self.tool_names = frozenset(tool_names or [])
         self._sentence_embeddings = sentence_embeddings
         self._embedding_classifier = EmbeddingClassifier()
+        # user_input → (версия LearnedPatterns, результат Tier 1/2)
+        self._route_cache: "OrderedDict[str, tuple]" = OrderedDict()
+        # (intent, user_input) → (версия LearnedPatterns, слоты)
+        self._slots_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+        # Tier 2.5 для route_async: encode + classify вне event loop.
+        # Один поток — запросы к классификатору идут по очереди
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="intent_router"
+        )
         self._build_rules()
 
+        # intent → обработчик: один dict-lookup вместо каскада if.
+        # Bound-методы — per-instance, поэтому не в _build_rules
+        self._slot_handlers = {
+            intent: self._slots_filepath for intent in _FILEPATH_INTENTS
+        }
+        self._slot_handlers.update({
+            "create_file": self._slots_create_file,
+            "launch_app": self._slots_launch_app,
+            "get_weather": self._slots_get_weather,
+            "web_search": self._slots_web_search,
+            "kill_process": self._slots_kill_process,
+            "get_currency_rate": self._slots_get_currency_rate,
+        })
+
         logger.info(
             f"🧭 IntentRouter: {len(self._rules)} правил, "
             f"{len(self.tool_names)} инструментов, "
             f"embedding_classifier={'on' if sentence_embeddings else 'off'}"
         )
 
-    def _build_rules(self):
+    @classmethod
+    def _build_rules(cls):
         """
         Захардкоженные правила (Tier 2).
         Это НАЧАЛЬНОЕ ЗНАНИЕ — как словарь для ребёнка.
         Со временем LearnedPatterns перекроет большинство из них.
+
+        Компилируется один раз на класс (при первом IntentRouter()):
+        паттерны, индекс триггеров и экстракторы неизменяемы и общие
+        для всех экземпляров.
+
+        Паттерны (и экстракторы слотов) — без re.I и в нижнем регистре:
+        route() матчит их по _lower(user_input), посчитанному один раз.
+
+        Порядок списка = приоритет: побеждает ПЕРВОЕ сработавшее правило,
+        а не самое левое совпадение. Поэтому правила не склеиваются в одну
+        альтернацию (?P<r0>…)|(?P<r1>…): она вернёт самое левое совпадение
+        («расскажи, какая погода» → explanation вместо get_weather), а
+        точная эмуляция порядка требует второго прохода, который на промахе
+        медленнее цикла — у объединённого regex нет общего префикса
+        и движок проверяет все ветки в каждой позиции.
+
+        RE2/Hyperscan здесь тоже не дают выигрыша: после префильтра
+        (_candidate_rules) проверяется 1-3 коротких regex, и накладные
+        расходы обёртки (UTF-8 кодирование, вызов C++) дороже самого поиска
+        (re2.search ~9мкс против ~2мкс у re). К тому же границы и классы
+        слов в RE2 — только ASCII, а негативный lookahead не поддерживается:
+        get_current_time, greeting и launch_app пришлось бы переписывать.
         """
-        self._rules = [
+        if cls._rules is not None:
+            return
+
+        rules = [
             # ── Файлы ──
             (re.compile(
                 r'(?:создай|сделай|напиши|сгенерируй)\s+'
                 r'(?:(?:текстовый|новый)\s+)?'
-                r'(?:файл|документ|текст)',
-                re.I),
+                r'(?:файл|документ|текст)'),
              "create_file", "executor"),
 
             (re.compile(
                 r'(?:удали|убери|сотри|удалить)\s+'
-                r'(?:этот\s+)?(?:файл|документ)',
-                re.I),
+                r'(?:этот\s+)?(?:файл|документ)'),
              "delete_file", "executor"),
 
             (re.compile(
                 r'(?:прочитай|прочти|открой|покажи|что\s+в)\s+'
-                r'(?:файл[ае]?|документ)',
-                re.I),
+                r'(?:файл[ае]?|документ)'),
              "read_file", "executor"),
 
             (re.compile(
-                r'(?:запиши|допиши|добавь)\s+(?:в|к)\s+(?:файл|документ)',
-                re.I),
+                r'(?:запиши|допиши|добавь)\s+(?:в|к)\s+(?:файл|документ)'),
              "append_file", "executor"),
 
             (re.compile(
-                r'(?:скопируй|копируй|копировать)\s+(?:файл|документ)',
-                re.I),
+                r'(?:скопируй|копируй|копировать)\s+(?:файл|документ)'),
              "copy_file", "executor"),
 
             (re.compile(
-                r'(?:перемести|перенеси|перемещ)\s+(?:файл|документ)',
-                re.I),
+                r'(?:перемести|перенеси|перемещ)\s+(?:файл|документ)'),
              "move_file", "executor"),
 
             (re.compile(
-                r'(?:переименуй|переименовать)\s+(?:файл|документ)',
-                re.I),
+                r'(?:переименуй|переименовать)\s+(?:файл|документ)'),
              "rename_file", "executor"),
 
             (re.compile(
                 r'(?:покажи|список|что\s+в)\s+'
-                r'(?:папк[еу]|директори[юи]|каталог[еу]|рабочем\s+столе)',
-                re.I),
+                r'(?:папк[еу]|директори[юи]|каталог[еу]|рабочем\s+столе)'),
              "list_directory", "executor"),
 
             (re.compile(
-                r'(?:создай|сделай)\s+(?:папку|директорию|каталог)',
-                re.I),
+                r'(?:создай|сделай)\s+(?:папку|директорию|каталог)'),
              "create_directory", "executor"),
 
             (re.compile(
-                r'(?:найди|поищи|поиск)\s+(?:файл[ыа]?)',
-                re.I),
+                r'(?:найди|поищи|поиск)\s+(?:файл[ыа]?)'),
              "search_files", "executor"),
 
             (re.compile(
                 r'(?:информаци[яю]|размер|вес|дата)\s+'
-                r'(?:о\s+)?(?:файл[ае])',
-                re.I),
+                r'(?:о\s+)?(?:файл[ае])'),
              "file_info", "executor"),
 
             (re.compile(
-                r'(?:заархивируй|упакуй|архив)',
-                re.I),
+                r'(?:заархивируй|упакуй|архив)'),
              "archive", "executor"),
 
             # ── Система ──
             (re.compile(
                 r'(?:запусти|открой|запустить|включи)\s+'
-                r'(?:приложение\s+)?(?!файл)([\wа-яёА-ЯЁ]+)',
-                re.I),
+                r'(?:приложение\s+)?(?!файл)([\wа-яёА-ЯЁ]+)'),
              "launch_app", "executor"),
 
             (re.compile(
                 r'(?:закрой|заверши|убей|останови)\s+'
-                r'(?:процесс|приложение)\s+',
-                re.I),
+                r'(?:процесс|приложение)\s+'),
              "kill_process", "executor"),
 
             (re.compile(
                 r'(?:статус|состояние|нагрузка)\s*'
-                r'(?:систем|компьютер|пк)?',
-                re.I),
+                r'(?:систем|компьютер|пк)?'),
              "system_status", "executor"),
 
             (re.compile(
                 r'(?:информаци[яю]|инфо)\s*(?:о\s+)?'
-                r'(?:систем[еу]|компьютер[еу]|пк)',
-                re.I),
+                r'(?:систем[еу]|компьютер[еу]|пк)'),
              "system_info", "executor"),
 
             (re.compile(
-                r'(?:процесс[ыа]|запущенные|список\s+процесс)',
-                re.I),
+                r'(?:процесс[ыа]|запущенные|список\s+процесс)'),
              "list_processes", "executor"),
 
             (re.compile(
-                r'(?:мест[оа]\s+на\s+диск|дисков|свободн[оа]\s+на\s+диск)',
-                re.I),
+                r'(?:мест[оа]\s+на\s+диск|дисков|свободн[оа]\s+на\s+диск)'),
              "disk_usage", "executor"),
 
             (re.compile(
-                r'(?:выполни\s+команд|терминал|командн\w+\s+строк)',
-                re.I),
+                r'(?:выполни\s+команд|терминал|командн\w+\s+строк)'),
              "run_command", "executor"),
 
             # ── Время / Погода / Валюта ──
             (re.compile(
                 r'(?:врем[яю]|\bчас\b|который\s+час|сколько\s+врем|'
-                r'какой\s+(?:сегодня\s+)?день)',
-                re.I),
+                r'какой\s+(?:сегодня\s+)?день)'),
              "get_current_time", "executor"),
 
             (re.compile(
-                r'(?:погод[аеу]|температур|градус|на\s+улице)',
-                re.I),
+                r'(?:погод[аеу]|температур|градус|на\s+улице)'),
              "get_weather", "executor"),
 
             (re.compile(
                 r'(?:курс|стоимость)\s+'
-                r'(?:доллар|евро|валют|рубл|юан|фунт|USD|EUR|CNY|GBP)',
-                re.I),
+                r'(?:доллар|евро|валют|рубл|юан|фунт|usd|eur|cny|gbp)'),
              "get_currency_rate", "executor"),
 
             # ── Память / Заметки ──
             (re.compile(
-                r'(?:вспомни|напомни|помнишь|что\s+(?:ты\s+)?знаешь)',
-                re.I),
+                r'(?:вспомни|напомни|помнишь|что\s+(?:ты\s+)?знаешь)'),
              "recall_memory", "executor"),
 
             (re.compile(
-                r'(?:сохрани|запиши|запомни)\s+(?:заметк|замечани)',
-                re.I),
+                r'(?:сохрани|запиши|запомни)\s+(?:заметк|замечани)'),
              "save_note", "executor"),
 
             (re.compile(
-                r'(?:покажи|список)\s+(?:замет[ок]|заметки)',
-                re.I),
+                r'(?:покажи|список)\s+(?:замет[ок]|заметки)'),
              "list_notes", "executor"),
 
             # ── Веб ──
             (re.compile(
                 r'(?:найди|поищи|загугли|погугли|search|'
-                r'что\s+(?:такое|значит)|(?:кто\s+(?:такой|такая)))',
-                re.I),
+                r'что\s+(?:такое|значит)|(?:кто\s+(?:такой|такая)))'),
              "web_search", "analyst"),
 
             (re.compile(
-                r'(?:скачай|загрузи|download)\s+(?:файл\s+)?(?:с|из|по)',
-                re.I),
+                r'(?:скачай|загрузи|download)\s+(?:файл\s+)?(?:с|из|по)'),
              "download_file", "executor"),
 
             # ── Диалог (director, без инструмента) ──
             (re.compile(
                 r'^(?:привет|здравствуй|хай|hello|добр\w+\s+'
-                r'(?:утро|день|вечер)|как\s+дела)',
-                re.I),
+                r'(?:утро|день|вечер)|как\s+дела)'),
              "greeting", "director"),
 
             (re.compile(
-                r'(?:расскажи|объясни|почему|зачем|как\s+работает)',
-                re.I),
+                r'(?:расскажи|объясни|почему|зачем|как\s+работает)'),
              "explanation", "director"),
 
             (re.compile(
                 r'(?:придумай|сочини|напиши\s+(?:стих|рассказ|историю|'
-                r'пожелани|поздравлени))',
-                re.I),
+                r'пожелани|поздравлени))'),
              "creative", "director"),
 
             # ── Самосознание / Личность / Философские вопросы ──
@@ -330,25 +677,196 @@ class IntentRouter:
                 r'у\s+тебя\s+(?:есть\s+)?(?:сознани|чувств|эмоци|душ)|'
                 r'ты\s+(?:человек|личност)|'
                 r'(?:что|как)\s+ты\s+(?:о\s+себе|думаешь\s+о\s+себе)|'
-                r'ты\s+(?:можешь\s+)?(?:мечтать|любить|бояться|грустить))',
-                re.I),
+                r'ты\s+(?:можешь\s+)?(?:мечтать|любить|бояться|грустить))'),
              "self_awareness", "director"),
 
             # ── Вопросы про возможности ──
             (re.compile(
                 r'(?:что\s+(?:ты\s+)?(?:умеешь|можешь|способн)|'
-                r'(?:на\s+что|чего)\s+ты\s+(?:способн|можешь))',
-                re.I),
+                r'(?:на\s+что|чего)\s+ты\s+(?:способн|можешь))'),
              "capabilities", "director"),
 
             # ── Как ты / Как дела / Что нового ──
             (re.compile(
                 r'(?:^как\s+(?:ты|у\s+тебя|твои\s+дела|поживаешь|настроение)|'
                 r'(?:что|как)\s+(?:нового|новенького)|'
-                r'как\s+(?:себя\s+)?чувствуешь)',
-                re.I),
+                r'как\s+(?:себя\s+)?чувствуешь)'),
              "smalltalk", "director"),
         ]
+        cls._build_trigger_index(rules)
+
+        # ── Извлечение слотов (см. _extract_slots_by_rules) ──
+        # Слоты, которые захватывает группа самого правила: intent → {слот: группа}
+        cls._rule_slot_groups: Dict[str, Dict[str, int]] = {
+            "launch_app": {"app_name": 1},
+        }
+        cls._filename_re = re.compile(
+            r'([\wа-яёА-ЯЁ\-]+\.[\wа-яёА-ЯЁ]+)'
+        )
+        cls._slot_extractors: Dict[str, List["re.Pattern"]] = {
+            # Содержимое после ключевых слов, по убыванию приоритета
+            "create_file": [
+                re.compile(
+                    r'(?:с\s+(?:текстом|содержимым|содержанием))\s*[:\-]?\s*(.+)'),
+                re.compile(r'(?:напиши|написать)\s*[:\-]?\s*(.+)'),
+                re.compile(r'\b(?:содержимое|текст)\b\s*[:\-]?\s*(.+)'),
+            ],
+            "launch_app": [
+                re.compile(
+                    r'(?:запусти|открой|включи)\s+(?:приложение\s+)?'
+                    r'([\wа-яёА-ЯЁ]+)'),
+            ],
+            "get_weather": [
+                re.compile(
+                    r'(?:погод[аеу]|температур\w*)\s+(?:в\s+)?([\wа-яёА-ЯЁ]+)'),
+            ],
+            # Всё после ключевого слова — запрос
+            "web_search": [
+                re.compile(r'(?:найди|поищи|загугли|погугли)\s+(.+)'),
+            ],
+            "kill_process": [
+                re.compile(
+                    r'(?:закрой|заверши|убей)\s+(?:процесс\s+)?'
+                    r'([\wа-яёА-ЯЁ]+)'),
+            ],
+            "get_currency_rate": [
+                re.compile(r'(доллар|евро|юан|фунт|usd|eur|cny|gbp|jpy)'),
+            ],
+        }
+        cls._rules = rules
+
+    @classmethod
+    def _build_trigger_index(cls, rules: List[tuple]):
+        """
+        Триггер → индексы правил (см. _RULE_TRIGGERS).
+
+        Бэкенды по убыванию скорости: pyahocorasick (C), DFA Ахо-Корасик
+        под Numba (маска правил в int64, поэтому до 63 правил), префиксное
+        дерево на dict. Все находят все триггеры за один проход по строке,
+        независимо от числа правил.
+
+        Правило, чей regex совпал с примером из _RULE_EXAMPLES без единого
+        триггера, проверяется всегда (как без триггеров) — с предупреждением.
+        """
+        by_trigger: Dict[str, set] = {}
+        cls._always_check = []  # правила без триггеров
+        for idx, (pattern, intent, _) in enumerate(rules):
+            triggers = _RULE_TRIGGERS.get(intent)
+            if not triggers:
+                cls._always_check.append(idx)
+                continue
+            missed = [
+                example for example in _RULE_EXAMPLES.get(intent, ())
+                if pattern.search(example)
+                and not any(trigger in example for trigger in triggers)
+            ]
+            if missed:
+                logger.warning(
+                    f"⚠️ Триггеры {intent} не покрывают {missed!r} — "
+                    f"правило без префильтра"
+                )
+                cls._always_check.append(idx)
+                continue
+            for trigger in triggers:
+                by_trigger.setdefault(trigger, set()).add(idx)
+
+        cls._trigger_automaton = None
+        cls._trigger_dfa = None
+        cls._trigger_trie: Dict = {}
+        if HAS_AHOCORASICK:
+            automaton = ahocorasick.Automaton()
+            for trigger, idxs in by_trigger.items():
+                automaton.add_word(trigger, frozenset(idxs))
+            automaton.make_automaton()
+            cls._trigger_automaton = automaton
+        elif HAS_NUMBA and len(rules) < 64:
+            cls._trigger_dfa = cls._compile_trigger_dfa(by_trigger)
+        else:
+            for trigger, idxs in by_trigger.items():
+                node = cls._trigger_trie
+                for ch in trigger:
+                    node = node.setdefault(ch, {})
+                node[""] = frozenset(idxs)
+
+    @staticmethod
+    def _compile_trigger_dfa(by_trigger: Dict[str, set]) -> tuple:
+        """
+        Триггеры → таблицы DFA Ахо-Корасик для _ac_scan.
+
+        Алфавит сжат до символов триггеров (класс 0 — все прочие, из него
+        всегда переход в корень). Fail-ссылки развёрнуты в полную таблицу
+        переходов обходом в ширину, маски выходов наследуются по ним же.
+        """
+        chars = sorted({ch for trigger in by_trigger for ch in trigger})
+        char_class = {ch: i + 1 for i, ch in enumerate(chars)}
+        n_classes = len(chars) + 1
+
+        # Бор: goto[state] = {class: state}, out[state] = маска правил
+        goto: List[Dict[int, int]] = [{}]
+        out = [0]
+        for trigger, idxs in by_trigger.items():
+            state = 0
+            for ch in trigger:
+                c = char_class[ch]
+                if c not in goto[state]:
+                    goto.append({})
+                    out.append(0)
+                    goto[state][c] = len(goto) - 1
+                state = goto[state][c]
+            for idx in idxs:
+                out[state] |= 1 << idx
+
+        delta = np.zeros((len(goto), n_classes), dtype=np.int32)
+        fail = [0] * len(goto)
+        queue = []
+        for c, child in goto[0].items():
+            delta[0, c] = child
+            queue.append(child)
+        for state in queue:  # BFS: очередь растёт по ходу обхода
+            out[state] |= out[fail[state]]
+            for c in range(n_classes):
+                child = goto[state].get(c)
+                if child is None:
+                    delta[state, c] = delta[fail[state], c]
+                else:
+                    fail[child] = delta[fail[state], c]
+                    delta[state, c] = child
+                    queue.append(child)
+
+        cp_class = np.zeros(max(map(ord, chars)) + 1, dtype=np.int32)
+        for ch, c in char_class.items():
+            cp_class[ord(ch)] = c
+        return cp_class, delta, np.array(out, dtype=np.int64)
+
+    def _candidate_rules(self, text_lower: str) -> List[int]:
+        """Индексы правил, чьи триггеры есть в строке, в порядке приоритета"""
+        found = set(self._always_check)
+        if self._trigger_automaton is not None:
+            for _, idxs in self._trigger_automaton.iter(text_lower):
+                found |= idxs
+        elif self._trigger_dfa is not None:
+            cp_class, delta, out = self._trigger_dfa
+            cps = np.frombuffer(text_lower.encode("utf-32-le"), dtype=np.uint32)
+            mask = _ac_scan(cps, cp_class, delta, out)
+            while mask:
+                low = mask & -mask
+                found.add(low.bit_length() - 1)
+                mask ^= low
+        else:
+            trie = self._trigger_trie
+            n = len(text_lower)
+            for i in range(n):
+                node = trie.get(text_lower[i])
+                j = i + 1
+                while node is not None:
+                    idxs = node.get("")
+                    if idxs:
+                        found |= idxs
+                    if j >= n:
+                        break
+                    node = node.get(text_lower[j])
+                    j += 1
+        return sorted(found)
 
     def route(self, user_input: str) -> Optional[Dict[str, Any]]:
         """
@@ -364,36 +882,161 @@ class IntentRouter:
               - source: str      — 'learned' | 'rule'
               - pattern_id: int? — ID паттерна (для reinforce/weaken)
               - slots: dict      — извлечённые аргументы
+
+        Результаты Tier 1/2 кэшируются (LRU) по точной строке запроса:
+        регистр и пробелы важны для слотов и якорей правил. Запись
+        устаревает при любом изменении LearnedPatterns (version).
+        Tier 2.5 не кэшируется — классификатор дообучается каждый ход.
+        """
+        version = self.learned.version
+        cached = self._cached_route(user_input, version)
+        if cached is not None:
+            return cached
+        result = self._route_uncached(
+            user_input, self.learned.find_routing(user_input)
+        )
+        return self._store_route(user_input, version, result)
+
+    async def route_async(self, user_input: str) -> Optional[Dict[str, Any]]:
+        """
+        route() для event loop оркестратора.
+
+        Tier 1/2 (кэш, SQLite, regex) — синхронно, как в route().
+        Tier 2.5 (encode + classify — numeric-работа на десятки мс)
+        уходит в поток self._executor, чтобы не блокировать остальные
+        корутины. Слоты Tier 2.5 извлекаются уже в loop: learned.find_slots
+        ходит в SQLite-соединение, привязанное к этому потоку.
+        """
+        version = self.learned.version
+        cached = self._cached_route(user_input, version)
+        if cached is not None:
+            return cached
+        result = self._route_rules(
+            user_input, self.learned.find_routing(user_input)
+        )
+        if result is None and self._sentence_embeddings:
+            loop = asyncio.get_running_loop()
+            emb_result = await loop.run_in_executor(
+                self._executor, self._classify_embedding, user_input
+            )
+            result = self._finish_embedding(user_input, emb_result)
+        if result is None:
+            self._log_miss(user_input)
+        return self._store_route(user_input, version, result)
+
+    def route_batch(self, inputs: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        route() для списка запросов (офлайн-разметка логов, бэкфилл).
+
+        Tier 1 для всех промахов кэша — одним find_routing_bulk (один
+        commit на обновление last_used вместо commit на каждый запрос).
+        Результат поэлементно совпадает с [route(s) for s in inputs].
+        """
+        version = self.learned.version
+        results = [self._cached_route(text, version) for text in inputs]
+        pending = list(dict.fromkeys(
+            text for text, result in zip(inputs, results) if result is None
+        ))
+        learned = dict(zip(pending, self.learned.find_routing_bulk(pending)))
+
+        for i, text in enumerate(inputs):
+            if results[i] is not None:
+                continue
+            # Повтор строки внутри батча мог уже попасть в кэш
+            cached = self._cached_route(text, version)
+            if cached is not None:
+                results[i] = cached
+                continue
+            learned_result = learned[text]
+            if learned_result is not None:
+                # _route_uncached дописывает slots — копия на каждый повтор
+                learned_result = dict(learned_result)
+            results[i] = self._store_route(
+                text, version, self._route_uncached(text, learned_result)
+            )
+        return results
+
+    def _cached_route(self, user_input: str, version: int) -> Optional[Dict[str, Any]]:
+        """Копия закэшированного результата или None"""
+        cached = self._route_cache.get(user_input)
+        if cached is None or cached[0] != version:
+            return None
+        self._route_cache.move_to_end(user_input)
+        return self._copy_route(cached[1])
+
+    def _store_route(self, user_input: str, version: int,
+                     result: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Кладёт результат Tier 1/2 в LRU и отдаёт копию вызывающему"""
+        if result is None or result["source"] not in ("learned", "rule"):
+            return result
+        self._route_cache[user_input] = (version, result)
+        self._route_cache.move_to_end(user_input)
+        if len(self._route_cache) > _ROUTE_CACHE_SIZE:
+            self._route_cache.popitem(last=False)
+        return self._copy_route(result)
+
+    @staticmethod
+    def _copy_route(result: Dict[str, Any]) -> Dict[str, Any]:
+        """Копия для вызывающего: slots уходят в executor как args"""
+        copy = dict(result)
+        copy["slots"] = dict(result["slots"])
+        return copy
+
+    def _route_uncached(self, user_input: str,
+                        learned_result: Optional[Dict]) -> Optional[Dict[str, Any]]:
+        """
+        Tier 1 → Tier 2 → Tier 2.5 без кэша (см. route).
+
+        learned_result — ответ learned.find_routing(user_input): его
+        запрашивает вызывающий (по одному или пачкой в route_batch).
         """
+        result = self._route_rules(user_input, learned_result)
+        if result is None and self._sentence_embeddings:
+            result = self._finish_embedding(
+                user_input, self._classify_embedding(user_input)
+            )
+        if result is None:
+            self._log_miss(user_input)
+        return result
+
+    def _route_rules(self, user_input: str,
+                     learned_result: Optional[Dict]) -> Optional[Dict[str, Any]]:
+        """Tier 1 → Tier 2: без эмбеддингов, все в потоке вызывающего"""
 
         # ── Tier 1: Выученные паттерны (<10мс) ──
-        learned_result = self.learned.find_routing(user_input)
         if learned_result and learned_result["confidence"] >= 0.7:
             # Также пытаемся извлечь аргументы
-            slots = self.learned.find_slots(
+            slots = self._find_learned_slots(
                 learned_result["intent"], user_input
             )
             learned_result["slots"] = slots
             logger.debug(
-                f"✅ Tier 1 (learned): {learned_result['intent']} "
-                f"(conf={learned_result['confidence']:.2f})"
+                "✅ Tier 1 (learned): %s (conf=%.2f)",
+                learned_result["intent"], learned_result["confidence"],
             )
             return learned_result
 
         # ── Tier 2: Захардкоженные правила (<5мс) ──
-        for pattern, intent, agent in self._rules:
-            if pattern.search(user_input):
+        # Правила без re.I — матчим по нижнему регистру, посчитанному один раз.
+        # Префильтр по триггерам: regex гоняем только у правил-кандидатов
+        text = _lower(user_input)
+        for idx in self._candidate_rules(text):
+            pattern, intent, agent = self._rules[idx]
+            match = pattern.search(text)
+            if match:
                 # Валидация: intent должен быть реальным инструментом
                 # (кроме director-специфичных как greeting, explanation, creative)
                 if agent == "executor" and intent not in self.tool_names:
                     continue
 
-                slots = self._extract_slots_by_rules(intent, user_input)
+                slots = self._extract_slots_by_rules(
+                    intent, user_input, match, text
+                )
 
                 # create_file без filepath — слишком сложный запрос для regex,
                 # отправляем в LLM (Tier 4) для генерации содержимого
                 if intent == "create_file" and "filepath" not in slots:
-                    logger.debug(f"⚠️ Tier 2: create_file без filepath → LLM")
+                    logger.debug("⚠️ Tier 2: create_file без filepath → LLM")
                     continue
 
                 result = {
@@ -404,34 +1047,56 @@ class IntentRouter:
                     "pattern_id": None,
                     "slots": slots,
                 }
-                logger.debug(f"✅ Tier 2 (rule): {intent}")
+                logger.debug("✅ Tier 2 (rule): %s", intent)
                 return result
 
-        # ── Tier 2.5: Embedding-based classification (<50мс) ──
-        if self._sentence_embeddings:
-            try:
-                embedding = self._sentence_embeddings.encode(user_input)
-                if embedding:
-                    emb_result = self._embedding_classifier.classify(embedding)
-                    if emb_result:
-                        # Валидируем intent
-                        if (emb_result["agent"] != "executor" or
-                                emb_result["intent"] in self.tool_names or
-                                emb_result["intent"] in ("greeting", "explanation", "creative")):
-                            slots = self._extract_slots_by_rules(emb_result["intent"], user_input)
-                            emb_result["slots"] = slots
-                            logger.debug(
-                                f"✅ Tier 2.5 (embedding): {emb_result['intent']} "
-                                f"(sim={emb_result['confidence']:.2f})"
-                            )
-                            return emb_result
-            except Exception as e:
-                logger.debug(f"Tier 2.5 error: {e}")
+        return None
 
-        # ── Ничего не нашли → Tier 3 (LLM) ──
-        logger.debug(f"⚠️ Tier 1+2+2.5 miss, нужен LLM для: '{user_input[:50]}'")
+    def _classify_embedding(self, user_input: str) -> Optional[Dict[str, Any]]:
+        """
+        Tier 2.5: Embedding-based classification (<50мс), без слотов.
+
+        Не трогает SQLite — безопасно вызывать из потока route_async.
+        """
+        try:
+            embedding = self._sentence_embeddings.encode(user_input)
+            if embedding is not None and len(embedding):
+                emb_result = self._embedding_classifier.classify(embedding)
+                if emb_result:
+                    # Валидируем intent
+                    intent = emb_result["intent"]
+                    if (emb_result["agent"] != "executor" or
+                            intent in self.tool_names or
+                            intent in _DIRECTOR_INTENTS):
+                        return emb_result
+        except Exception as e:
+            logger.debug("Tier 2.5 error: %s", e)
         return None
 
+    def _finish_embedding(self, user_input: str,
+                          emb_result: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Слоты для ответа Tier 2.5 (в потоке владельца SQLite)"""
+        if emb_result is None:
+            return None
+        try:
+            emb_result["slots"] = self._extract_slots_by_rules(
+                emb_result["intent"], user_input
+            )
+        except Exception as e:
+            logger.debug("Tier 2.5 error: %s", e)
+            return None
+        logger.debug(
+            "✅ Tier 2.5 (embedding): %s (sim=%.2f)",
+            emb_result["intent"], emb_result["confidence"],
+        )
+        return emb_result
+
+    @staticmethod
+    def _log_miss(user_input: str):
+        # ── Ничего не нашли → Tier 3 (LLM) ──
+        # Форматирование (и обрезка %.50s) — только если debug включён
+        logger.debug("⚠️ Tier 1+2+2.5 miss, нужен LLM для: '%.50s'", user_input)
+
     def learn_from_route(self, user_input: str, intent: str, agent: str):
         """
         v7.4: Обучает EmbeddingClassifier на каждом успешном роутинге.
@@ -440,92 +1105,113 @@ class IntentRouter:
         if self._sentence_embeddings:
             try:
                 embedding = self._sentence_embeddings.encode(user_input)
-                if embedding:
+                if embedding is not None and len(embedding):
                     self._embedding_classifier.add_example(intent, agent, embedding)
             except Exception:
                 pass
 
-    def _extract_slots_by_rules(self, intent: str, user_input: str) -> Dict[str, str]:
+    def _find_learned_slots(self, intent: str, user_input: str) -> Dict[str, str]:
+        """
+        learned.find_slots с LRU-кэшем между запросами.
+
+        Запись устаревает при изменении LearnedPatterns (version).
+        Вызывающий получает копию — слоты уходят в executor как args.
+        """
+        key = (intent, user_input)
+        version = self.learned.version
+        cached = self._slots_cache.get(key)
+        if cached is not None and cached[0] == version:
+            self._slots_cache.move_to_end(key)
+            return dict(cached[1])
+
+        slots = self.learned.find_slots(intent, user_input)
+        self._slots_cache[key] = (version, slots)
+        self._slots_cache.move_to_end(key)
+        if len(self._slots_cache) > _SLOTS_CACHE_SIZE:
+            self._slots_cache.popitem(last=False)
+        return dict(slots)
+
+    def _extract_slots_by_rules(self, intent: str, user_input: str,
+                                rule_match: Optional["re.Match"] = None,
+                                text: Optional[str] = None) -> Dict[str, str]:
         """
         Извлечение аргументов из текста правилами.
 
         Сначала пробует learned slots, потом захардкоженные regex.
+        rule_match — совпадение Tier-2 правила: если оно уже захватило
+        слот (_rule_slot_groups), строку повторно не сканируем.
+        text — _lower(user_input): regex-ы матчатся по нему, а значения
+        слотов вырезаются из user_input по тем же позициям (_group).
         """
         # Tier 1: Выученные slot-паттерны
-        slots = self.learned.find_slots(intent, user_input)
+        slots = self._find_learned_slots(intent, user_input)
         if slots:
             return slots
 
-        # Tier 2: Базовые правила
-        slots = {}
-
-        if intent in ("create_file", "read_file", "delete_file",
-                       "write_file", "append_file", "file_info"):
-            # Ищем имя файла
-            match = re.search(
-                r'([\wа-яёА-ЯЁ\-]+\.[\wа-яёА-ЯЁ]+)', user_input, re.I
-            )
-            if match:
-                slots["filepath"] = match.group(1)
-
-        if intent == "create_file":
-            # Ищем содержимое после ключевых слов
-            for pattern in [
-                r'(?:с\s+(?:текстом|содержимым|содержанием))\s*[:\-]?\s*(.+)',
-                r'(?:напиши|написать)\s*[:\-]?\s*(.+)',
-                r'\b(?:содержимое|текст)\b\s*[:\-]?\s*(.+)',
-            ]:
-                match = re.search(pattern, user_input, re.I)
-                if match:
-                    slots["content"] = match.group(1).strip()
-                    break
-
-        if intent == "launch_app":
-            match = re.search(
-                r'(?:запусти|открой|включи)\s+(?:приложение\s+)?'
-                r'([\wа-яёА-ЯЁ]+)',
-                user_input, re.I
-            )
-            if match:
-                slots["app_name"] = match.group(1)
+        if text is None:
+            text = _lower(user_input)
 
-        if intent == "get_weather":
-            match = re.search(
-                r'(?:погод[аеу]|температур\w*)\s+(?:в\s+)?([\wа-яёА-ЯЁ]+)',
-                user_input, re.I
-            )
-            if match:
-                slots["city"] = match.group(1)
-
-        if intent == "web_search":
-            # Всё после ключевого слова — запрос
-            match = re.search(
-                r'(?:найди|поищи|загугли|погугли)\s+(.+)',
-                user_input, re.I
-            )
-            if match:
-                slots["query"] = match.group(1).strip()
+        if rule_match is not None:
+            groups = self._rule_slot_groups.get(intent)
+            if groups:
+                return {
+                    name: self._group(user_input, text, rule_match, g)
+                    for name, g in groups.items()
+                    if rule_match.group(g)
+                }
 
-        if intent == "kill_process":
-            match = re.search(
-                r'(?:закрой|заверши|убей)\s+(?:процесс\s+)?'
-                r'([\wа-яёА-ЯЁ]+)',
-                user_input, re.I
-            )
-            if match:
-                slots["process_name"] = match.group(1)
+        # Tier 2: Базовые правила — один обработчик на intent
+        handler = self._slot_handlers.get(intent)
+        return handler(user_input, text) if handler else {}
 
-        if intent == "get_currency_rate":
-            match = re.search(
-                r'(доллар|евро|юан|фунт|USD|EUR|CNY|GBP|JPY)',
-                user_input, re.I
-            )
+    @staticmethod
+    def _group(user_input: str, text: str, match: "re.Match", group: int = 1) -> str:
+        """Группа совпадения по text → та же подстрока исходного user_input"""
+        start, end = match.span(group)
+        return user_input[start:end]
+
+    def _slots_filepath(self, user_input: str, text: str) -> Dict[str, str]:
+        """Имя файла (read/delete/write/append/file_info)"""
+        # Имя файла — всегда с точкой: без неё regex не запускаем
+        if "." not in text:
+            return {}
+        match = self._filename_re.search(text)
+        return {"filepath": self._group(user_input, text, match)} if match else {}
+
+    def _slots_create_file(self, user_input: str, text: str) -> Dict[str, str]:
+        """Имя файла + содержимое после ключевых слов"""
+        slots = self._slots_filepath(user_input, text)
+        for pattern in self._slot_extractors["create_file"]:
+            match = pattern.search(text)
             if match:
-                mapping = {
-                    "доллар": "USD", "евро": "EUR", "юан": "CNY",
-                    "фунт": "GBP",
-                }
-                raw = match.group(1)
-                slots["currency"] = mapping.get(raw.lower(), raw.upper())
-
+                slots["content"] = self._group(user_input, text, match).strip()
+                break
         return slots
+
+    def _slots_launch_app(self, user_input: str, text: str) -> Dict[str, str]:
+        match = self._slot_extractors["launch_app"][0].search(text)
+        return {"app_name": self._group(user_input, text, match)} if match else {}
+
+    def _slots_get_weather(self, user_input: str, text: str) -> Dict[str, str]:
+        match = self._slot_extractors["get_weather"][0].search(text)
+        return {"city": self._group(user_input, text, match)} if match else {}
+
+    def _slots_web_search(self, user_input: str, text: str) -> Dict[str, str]:
+        """Всё после ключевого слова — запрос"""
+        match = self._slot_extractors["web_search"][0].search(text)
+        if not match:
+            return {}
+        return {"query": self._group(user_input, text, match).strip()}
+
+    def _slots_kill_process(self, user_input: str, text: str) -> Dict[str, str]:
+        match = self._slot_extractors["kill_process"][0].search(text)
+        if not match:
+            return {}
+        return {"process_name": self._group(user_input, text, match)}
+
+    def _slots_get_currency_rate(self, user_input: str, text: str) -> Dict[str, str]:
+        match = self._slot_extractors["get_currency_rate"][0].search(text)
+        if not match:
+            return {}
+        # Группа из text уже в нижнем регистре — сразу ключ словаря
+        return {"currency": _CURRENCY_MAP[match.group(1)]}
@@ -52,9 +52,27 @@ import sqlite3
 import json
 import re
 import time
+import functools
 from pathlib import Path
 from typing import Dict, List, Tuple, Optional, Any
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+
+# JSON-колонки (steps_json, variables_json, example_inputs, ...) —
+# компактный UTF-8 без экранирования; формат одинаков с orjson и без
+try:
+    import orjson
+
+    def _json_loads(data):
+        return orjson.loads(data)
+
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+except ImportError:
+    def _json_loads(data):
+        return json.loads(data)
+
+    def _json_dumps(obj) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
 
 from utils.logging import get_logger
 import config
@@ -65,38 +83,121 @@ logger = get_logger("knowledge_distillation")
 #               ПАРСИНГ ЦЕПОЧЕК РАССУЖДЕНИЙ
 # ═══════════════════════════════════════════════════════════════
 
-# Паттерны для распознавания шагов в ответе LLM
-STEP_PATTERNS = [
-    # Нумерованные списки
-    re.compile(r'^\s*(\d+)[.)]\s*(.+)', re.MULTILINE),
-    # Маркированные списки
-    re.compile(r'^\s*[-•*]\s*(.+)', re.MULTILINE),
-    # "Шаг N:" формат
-    re.compile(r'(?:шаг|step)\s*(\d+)\s*[:.]\s*(.+)', re.IGNORECASE | re.MULTILINE),
-    # "Сначала..., затем..., потом..."
-    re.compile(r'(?:сначала|первым делом|для начала)\s+(.+?)(?:\.|$)', re.IGNORECASE),
-    re.compile(r'(?:затем|далее|потом|после этого)\s+(.+?)(?:\.|$)', re.IGNORECASE),
-    re.compile(r'(?:наконец|в конце|в итоге)\s+(.+?)(?:\.|$)', re.IGNORECASE),
+# Паттерны для распознавания шагов в ответе LLM (_parse_reasoning_steps).
+# Компилируются один раз: без поиска в кэше re на каждый вызов
+_NUMBERED_RE = re.compile(r'^\s*(\d+)[.)]\s*(.+?)$', re.MULTILINE)
+_BULLETED_RE = re.compile(r'^\s*[-•*]\s*(.+?)$', re.MULTILINE)
+
+# "Сначала..., затем..., потом..." → (паттерн, тип шага)
+_SEQUENTIAL_MARKERS = [
+    (re.compile(r'(?:сначала|первым делом|для начала)\s+(.+?)(?:\.|,|;|$)',
+                re.IGNORECASE), "first"),
+    (re.compile(r'(?:затем|далее|потом|после этого|после)\s+(.+?)(?:\.|,|;|$)',
+                re.IGNORECASE), "then"),
+    (re.compile(r'(?:наконец|в конце|в итоге|в результате)\s+(.+?)(?:\.|$)',
+                re.IGNORECASE), "finally"),
 ]
 
+# Fallback: предложения с глаголами действия
+_SENTENCE_SPLIT_RE = re.compile(r'[.!]\s+')
+# Слова, которые не годятся в {topic} (_extract_variables)
+_TOPIC_STOP_WORDS = frozenset({
+    "создай", "сделай", "напиши", "найди", "покажи",
+    "файл", "папку", "приложение", "для", "на", "в", "с",
+    "как", "что", "это", "нужно", "можно", "пожалуйста",
+})
+
+# Глаголы действия для fallback-разбора по предложениям
+_ACTION_KEYWORDS_RE = re.compile(
+    r'нужно|необходимо|следует|можно|надо|создай|открой|запусти|найди|проверь',
+    re.IGNORECASE,
+)
+
+# Переменные запроса (_extract_variables) и обобщение шагов
+_FILE_RE = re.compile(r'([\w\-]+\.\w{1,5})')
+_PATH_RE = re.compile(r'([/~][\w/\-.]+)')
+_LANGUAGE_RE = re.compile(
+    r'\b(python|javascript|typescript|java|rust|go|ruby|'
+    r'php|c\+\+|swift|kotlin)\b', re.I
+)
+
+# Слова для FTS5 (_extract_keywords) и незаполненные {переменные}.
+# Короткие слова (<= 2 символов) отсекает сам regex.
+_WORD_RE = re.compile(r'[а-яёa-z0-9]{3,}')
+_UNFILLED_VAR_RE = re.compile(r'\{[a-z_]+\}')
+
+# Размер LRU-кэша результатов find_reasoning
+_RESOLVE_CACHE_SIZE = 1024
+
+# Как часто сбрасывать накопленные last_used и feedback в БД (секунды)
+_PENDING_FLUSH_INTERVAL = 30.0
+
 # Ключевые слова для обобщения (конкретное → переменная)
 GENERALIZATION_PATTERNS = [
     # Имена файлов → {filename}
-    (re.compile(r'[\w\-]+\.\w{1,5}'), "{filename}"),
+    (_FILE_RE, "{filename}"),
     # Пути → {filepath}
-    (re.compile(r'[/~][\w/\-.]+'), "{filepath}"),
+    (_PATH_RE, "{filepath}"),
     # Числа → {number}
     (re.compile(r'\b\d{2,}\b'), "{number}"),
     # URL → {url}
     (re.compile(r'https?://\S+'), "{url}"),
     # Языки программирования → {language}
-    (re.compile(
-        r'\b(python|javascript|typescript|java|rust|go|ruby|'
-        r'php|c\+\+|swift|kotlin)\b', re.I
-    ), "{language}"),
+    (_LANGUAGE_RE, "{language}"),
 ]
 
 
+# Стоп-слова для FTS5 (_extract_keywords)
+_KEYWORD_STOP_WORDS = frozenset({
+    "я", "ты", "он", "она", "мы", "вы", "они",
+    "в", "на", "и", "с", "по", "от", "к", "не",
+    "что", "это", "как", "но", "а", "или", "да", "нет",
+    "можешь", "пожалуйста", "мне", "для", "меня",
+})
+
+
+# Одни и те же запросы (повторы, шаги шаблонов в verify_chain) приходят
+# многократно — разбор чистый, поэтому кэшируем по тексту
+@functools.lru_cache(maxsize=4096)
+def _extract_keywords_cached(text: str) -> str:
+    words = _WORD_RE.findall(text.lower())
+    keywords = [w for w in words if w not in _KEYWORD_STOP_WORDS]
+    return " ".join(keywords[:15])
+
+
+@functools.lru_cache(maxsize=1024)
+def _extract_variables_cached(user_input: str) -> Dict[str, str]:
+    variables = {}
+
+    # Имена файлов (без точки совпадений быть не может)
+    files = _FILE_RE.findall(user_input) if "." in user_input else ()
+    for i, f in enumerate(files):
+        key = "filename" if i == 0 else f"filename_{i+1}"
+        variables[key] = f
+
+    # Пути (начинаются с / или ~)
+    if "/" in user_input or "~" in user_input:
+        paths = _PATH_RE.findall(user_input)
+    else:
+        paths = ()
+    for i, p in enumerate(paths):
+        key = "filepath" if i == 0 else f"filepath_{i+1}"
+        variables[key] = p
+
+    # Языки программирования
+    langs = _LANGUAGE_RE.findall(user_input)
+    if langs:
+        variables["language"] = langs[0].lower()
+
+    # Ключевые существительные (простая эвристика)
+    for w in user_input.lower().split():
+        if len(w) > 3 and w not in _TOPIC_STOP_WORDS:
+            variables["topic"] = w
+            break
+
+    return variables
+
+
 class KnowledgeDistillation:
     """
     Дистилляция знаний из LLM — учимся ДУМАТЬ, а не запоминать.
@@ -133,8 +234,28 @@ class KnowledgeDistillation:
 
         self._conn = sqlite3.connect(str(self._db_path))
         self._conn.row_factory = sqlite3.Row
+        # page_size действует только на новой БД и только до перехода в WAL
+        self._conn.execute("PRAGMA page_size=8192")
         self._conn.execute("PRAGMA journal_mode=WAL")
         self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA temp_store=MEMORY")
+        if config.config.sqlite_memory_tuning:
+            # find_reasoning читает FTS + JOIN на каждом ходе:
+            # mmap и кэш страниц убирают read()-syscall'ы
+            self._conn.execute("PRAGMA mmap_size=268435456")
+            self._conn.execute("PRAGMA cache_size=-65536")
+
+        # (user_input, intent, min_confidence) → результат find_reasoning.
+        # Сбрасывается при любом изменении цепочек/шаблонов.
+        self._resolve_cache: "OrderedDict[tuple, Optional[Dict]]" = OrderedDict()
+        # chain_id → last_used, ещё не записанные в БД (последний выигрывает).
+        # Сбрасываются в потоке вызывающего: соединение sqlite3 привязано
+        # к потоку, где создано, поэтому фонового таймера нет
+        self._last_used_pending: Dict[int, float] = {}
+        # Отложенный feedback: (source, id, useful) в порядке поступления —
+        # зажим confidence в [0, 1] зависит от порядка
+        self._feedback_pending: List[Tuple[str, int, bool]] = []
+        self._pending_flushed_at = time.time()
 
         self._create_tables()
 
@@ -161,10 +282,25 @@ class KnowledgeDistillation:
                 successes INTEGER DEFAULT 1,
                 failures INTEGER DEFAULT 0,
                 created_at REAL NOT NULL,
-                last_used REAL NOT NULL
+                last_used REAL NOT NULL,
+                score REAL GENERATED ALWAYS AS (
+                    confidence * (CAST(successes AS REAL) / (failures + 1))
+                ) VIRTUAL
             )
         """)
 
+        # Старые БД: score ещё нет. STORED через ALTER TABLE добавить
+        # нельзя, поэтому колонка VIRTUAL (и в CREATE выше — для единообразия)
+        try:
+            cur.execute("""
+                ALTER TABLE reasoning_chains ADD COLUMN score REAL
+                GENERATED ALWAYS AS (
+                    confidence * (CAST(successes AS REAL) / (failures + 1))
+                ) VIRTUAL
+            """)
+        except sqlite3.OperationalError:
+            pass  # duplicate column — уже есть
+
         # Обобщённые шаблоны (generalized templates)
         cur.execute("""
             CREATE TABLE IF NOT EXISTS reasoning_templates (
@@ -180,6 +316,33 @@ class KnowledgeDistillation:
             )
         """)
 
+        # Шаги цепочек построчно — для статистики и запросов по шагам.
+        # steps_json остаётся: find_reasoning читает цепочку целиком
+        has_steps_table = cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'reasoning_steps'"
+        ).fetchone() is not None
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS reasoning_steps (
+                chain_id INTEGER NOT NULL,
+                step_idx INTEGER NOT NULL,
+                step INTEGER,
+                type TEXT,
+                text TEXT NOT NULL,
+                PRIMARY KEY (chain_id, step_idx)
+            )
+        """)
+        if not has_steps_table:
+            # Старые БД: переносим шаги из steps_json
+            cur.execute("""
+                INSERT INTO reasoning_steps (chain_id, step_idx, step, type, text)
+                SELECT rc.id, je.key,
+                       json_extract(je.value, '$.step'),
+                       json_extract(je.value, '$.type'),
+                       json_extract(je.value, '$.text')
+                FROM reasoning_chains rc, json_each(rc.steps_json) je
+                WHERE json_valid(rc.steps_json)
+            """)
+
         # FTS5 для поиска по ключевым словам
         cur.execute("""
             CREATE VIRTUAL TABLE IF NOT EXISTS chains_fts
@@ -187,9 +350,22 @@ class KnowledgeDistillation:
         """)
 
         # Индексы
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_chains_intent ON reasoning_chains(intent)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_chains_conf ON reasoning_chains(confidence DESC)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_templates_intent ON reasoning_templates(intent_pattern)")
+        # Один составной индекс вместо idx_chains_intent + idx_chains_conf:
+        # покрывает DISTINCT intent и подсчёт сильных цепочек в get_stats
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_chains_lookup "
+            "ON reasoning_chains(intent, confidence DESC)"
+        )
+        cur.execute("DROP INDEX IF EXISTS idx_chains_intent")
+        cur.execute("DROP INDEX IF EXISTS idx_chains_conf")
+        # _find_by_template: intent_pattern = ? ORDER BY usage_count DESC
+        # идёт по индексу без сортировки; префикс покрывает и поиск по intent
+        # в _update_template, поэтому старый idx_templates_intent не нужен
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_templates_rank "
+            "ON reasoning_templates(intent_pattern, usage_count DESC)"
+        )
+        cur.execute("DROP INDEX IF EXISTS idx_templates_intent")
 
         self._conn.commit()
 
@@ -216,10 +392,65 @@ class KnowledgeDistillation:
         Returns:
             chain_id или None (если не удалось извлечь рассуждения)
         """
+        return self.distill_many([
+            (user_input, llm_response, intent, result_success),
+        ])[0]
+
+    def distill_many(
+        self,
+        records: List[Tuple[str, str, str, bool]],
+    ) -> List[Optional[int]]:
+        """
+        distill для пачки ответов (реплей истории, пакетное обучение).
+
+        records — кортежи (user_input, llm_response, intent, result_success).
+        Цепочки и шаблоны пишутся в одной транзакции с одним commit,
+        FTS-индекс — одним executemany. Результат поэлементно совпадает
+        с [distill(*r) for r in records].
+        """
+        chain_ids: List[Optional[int]] = []
+        fts_rows = []
+        cur = self._conn.cursor()
+        try:
+            self._flush_pending()
+            for user_input, llm_response, intent, result_success in records:
+                chain_id, keywords = self._insert_chain(
+                    cur, user_input, llm_response, intent, result_success
+                )
+                chain_ids.append(chain_id)
+                if chain_id is not None:
+                    fts_rows.append((chain_id, keywords))
+
+            # Обновляем FTS
+            if fts_rows:
+                cur.executemany("""
+                    INSERT INTO chains_fts (rowid, keywords) VALUES (?, ?)
+                """, fts_rows)
+
+            self._conn.commit()
+        except Exception:
+            # Не оставляем половину пачки висеть в открытой транзакции
+            self._conn.rollback()
+            raise
+        finally:
+            # Новые цепочки/шаблоны меняют выдачу find_reasoning
+            self._resolve_cache.clear()
+
+        return chain_ids
+
+    def _insert_chain(
+        self,
+        cur: sqlite3.Cursor,
+        user_input: str,
+        llm_response: str,
+        intent: str,
+        result_success: bool,
+    ) -> Tuple[Optional[int], str]:
+        """Одна цепочка + шаблон без commit и без FTS (см. distill_many)"""
         # 1. Парсим шаги из ответа LLM
         steps = self._parse_reasoning_steps(llm_response)
         if not steps:
-            return None
+            return None, ""
 
         # 2. Извлекаем переменные (конкретные значения)
         variables = self._extract_variables(user_input, llm_response)
@@ -229,7 +460,6 @@ class KnowledgeDistillation:
 
         # 4. Сохраняем конкретную цепочку
         now = time.time()
-        cur = self._conn.cursor()
         cur.execute("""
             INSERT INTO reasoning_chains
             (user_input, intent, keywords, steps_json, variables_json,
@@ -237,29 +467,29 @@ class KnowledgeDistillation:
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         """, (
             user_input, intent, keywords,
-            json.dumps(steps, ensure_ascii=False),
-            json.dumps(variables, ensure_ascii=False),
+            _json_dumps(steps),
+            _json_dumps(variables),
             1.0 if result_success else 0.5,
             now, now,
         ))
         chain_id = cur.lastrowid
-
-        # Обновляем FTS
-        cur.execute("""
-            INSERT INTO chains_fts (rowid, keywords) VALUES (?, ?)
-        """, (chain_id, keywords))
+        cur.executemany("""
+            INSERT INTO reasoning_steps (chain_id, step_idx, step, type, text)
+            VALUES (?, ?, ?, ?, ?)
+        """, [
+            (chain_id, idx, step["step"], step["type"], step["text"])
+            for idx, step in enumerate(steps)
+        ])
 
         # 5. Пытаемся создать/обновить обобщённый шаблон
         self._update_template(intent, steps, variables, user_input)
 
-        self._conn.commit()
-
         logger.debug(
             f"🧪 Distilled: '{user_input[:50]}' → {len(steps)} steps, "
             f"{len(variables)} vars, chain_id={chain_id}"
         )
 
-        return chain_id
+        return chain_id, keywords
 
     def _parse_reasoning_steps(self, text: str) -> List[Dict]:
         """
@@ -274,9 +504,7 @@ class KnowledgeDistillation:
         steps = []
 
         # Пробуем нумерованный список
-        numbered = re.findall(
-            r'^\s*(\d+)[.)]\s*(.+?)$', text, re.MULTILINE
-        )
+        numbered = _NUMBERED_RE.findall(text)
         if len(numbered) >= 2:
             for num, step_text in numbered:
                 steps.append({
@@ -287,9 +515,7 @@ class KnowledgeDistillation:
             return steps
 
         # Пробуем маркированный список
-        bulleted = re.findall(
-            r'^\s*[-•*]\s*(.+?)$', text, re.MULTILINE
-        )
+        bulleted = _BULLETED_RE.findall(text)
         if len(bulleted) >= 2:
             for i, step_text in enumerate(bulleted, 1):
                 steps.append({
@@ -300,15 +526,9 @@ class KnowledgeDistillation:
             return steps
 
         # Пробуем последовательные маркеры
-        sequential_markers = [
-            (r'(?:сначала|первым делом|для начала)\s+(.+?)(?:\.|,|;|$)', "first"),
-            (r'(?:затем|далее|потом|после этого|после)\s+(.+?)(?:\.|,|;|$)', "then"),
-            (r'(?:наконец|в конце|в итоге|в результате)\s+(.+?)(?:\.|$)', "finally"),
-        ]
-
         step_num = 0
-        for pattern, step_type in sequential_markers:
-            matches = re.findall(pattern, text, re.IGNORECASE)
+        for pattern, step_type in _SEQUENTIAL_MARKERS:
+            matches = pattern.findall(text)
             for match in matches:
                 step_num += 1
                 steps.append({
@@ -321,18 +541,16 @@ class KnowledgeDistillation:
             return steps
 
         # Fallback: разбиваем по предложениям (если текст содержит логические шаги)
-        sentences = re.split(r'[.!]\s+', text)
-        action_sentences = [
-            s.strip() for s in sentences
-            if len(s.strip()) > 10 and any(
-                kw in s.lower() for kw in
-                ["нужно", "необходимо", "следует", "можно", "надо",
-                 "создай", "открой", "запусти", "найди", "проверь"]
-            )
-        ]
+        action_sentences = []
+        for sent in _SENTENCE_SPLIT_RE.split(text):
+            sent = sent.strip()
+            if len(sent) > 10 and _ACTION_KEYWORDS_RE.search(sent):
+                action_sentences.append(sent)
+                if len(action_sentences) == 10:
+                    break
 
         if len(action_sentences) >= 2:
-            for i, sent in enumerate(action_sentences[:10], 1):
+            for i, sent in enumerate(action_sentences, 1):
                 steps.append({
                     "step": i,
                     "text": sent,
@@ -344,52 +562,12 @@ class KnowledgeDistillation:
 
     def _extract_variables(self, user_input: str, llm_response: str) -> Dict[str, str]:
         """Извлекает переменные (конкретные значения) из запроса"""
-        variables = {}
-
-        # Имена файлов
-        files = re.findall(r'([\w\-]+\.\w{1,5})', user_input)
-        for i, f in enumerate(files):
-            key = "filename" if i == 0 else f"filename_{i+1}"
-            variables[key] = f
-
-        # Пути
-        paths = re.findall(r'([/~][\w/\-.]+)', user_input)
-        for i, p in enumerate(paths):
-            key = "filepath" if i == 0 else f"filepath_{i+1}"
-            variables[key] = p
-
-        # Языки программирования
-        langs = re.findall(
-            r'\b(python|javascript|typescript|java|rust|go|ruby|'
-            r'php|c\+\+|swift|kotlin)\b', user_input, re.I
-        )
-        if langs:
-            variables["language"] = langs[0].lower()
-
-        # Ключевые существительные (простая эвристика)
-        words = user_input.lower().split()
-        stop = {
-            "создай", "сделай", "напиши", "найди", "покажи",
-            "файл", "папку", "приложение", "для", "на", "в", "с",
-            "как", "что", "это", "нужно", "можно", "пожалуйста",
-        }
-        meaningful = [w for w in words if w not in stop and len(w) > 3]
-        if meaningful:
-            variables["topic"] = meaningful[0]
-
-        return variables
+        # Копия: результат из кэша не должен меняться у вызывающего
+        return dict(_extract_variables_cached(user_input))
 
     def _extract_keywords(self, text: str) -> str:
         """Извлекает ключевые слова для FTS5"""
-        stop_words = {
-            "я", "ты", "он", "она", "мы", "вы", "они",
-            "в", "на", "и", "с", "по", "от", "к", "не",
-            "что", "это", "как", "но", "а", "или", "да", "нет",
-            "можешь", "пожалуйста", "мне", "для", "меня",
-        }
-        words = re.findall(r'[а-яёa-z0-9]+', text.lower())
-        keywords = [w for w in words if len(w) > 2 and w not in stop_words]
-        return " ".join(keywords[:15])
+        return _extract_keywords_cached(text)
 
     def _update_template(
         self,
@@ -420,11 +598,11 @@ class KnowledgeDistillation:
         """, (intent,)).fetchone()
 
         now = time.time()
-        variable_slots = json.dumps(list(variables.keys()), ensure_ascii=False)
+        variable_slots = _json_dumps(list(variables.keys()))
 
         if existing:
             # Обновляем: добавляем пример
-            examples = json.loads(existing["example_inputs"])
+            examples = _json_loads(existing["example_inputs"])
             if user_input not in examples:
                 examples.append(user_input)
                 examples = examples[-20:]  # Храним максимум 20 примеров
@@ -433,7 +611,7 @@ class KnowledgeDistillation:
                 UPDATE reasoning_templates
                 SET example_inputs = ?, usage_count = usage_count + 1, updated_at = ?
                 WHERE id = ?
-            """, (json.dumps(examples, ensure_ascii=False), now, existing["id"]))
+            """, (_json_dumps(examples), now, existing["id"]))
         else:
             # Создаём новый шаблон
             self._conn.execute("""
@@ -443,9 +621,9 @@ class KnowledgeDistillation:
                 VALUES (?, ?, ?, ?, ?, ?)
             """, (
                 intent,
-                json.dumps(template_steps, ensure_ascii=False),
+                _json_dumps(template_steps),
                 variable_slots,
-                json.dumps([user_input], ensure_ascii=False),
+                _json_dumps([user_input]),
                 now, now,
             ))
 
@@ -475,50 +653,68 @@ class KnowledgeDistillation:
             - source: "exact" | "template"
             Или None если ничего не нашли
         """
+        key = (user_input, intent or "", min_confidence)
+        if key in self._resolve_cache:
+            self._resolve_cache.move_to_end(key)
+            result = self._resolve_cache[key]
+            if result is None:
+                return None
+            if result["source"] == "exact":
+                self._touch_chain(result["chain_id"])
+            return self._copy_reasoning(result)
+
+        result = self._find_reasoning_uncached(user_input, intent, min_confidence)
+        self._resolve_cache[key] = result
+        if len(self._resolve_cache) > _RESOLVE_CACHE_SIZE:
+            self._resolve_cache.popitem(last=False)
+        return self._copy_reasoning(result) if result is not None else None
+
+    def _find_reasoning_uncached(
+        self,
+        user_input: str,
+        intent: str = None,
+        min_confidence: float = 0.6,
+    ) -> Optional[Dict]:
+        """find_reasoning без кэша: FTS5 → ранжирование → шаблоны"""
+        # Ранжирование читает confidence — отложенный feedback нужен в БД
+        self._sync_pending()
+
         keywords = self._extract_keywords(user_input)
         if not keywords:
             return None
 
-        # 1. Поиск конкретной цепочки через FTS5
+        # 1. Поиск конкретной цепочки через FTS5: топ-5 по rank,
+        # 2. среди них — сначала цепочки нужного intent (если указан),
+        #    затем score = confidence * успехи/(провалы+1), затем FTS rank
         try:
-            rows = self._conn.execute("""
-                SELECT rc.id, rc.user_input, rc.intent, rc.steps_json,
-                       rc.variables_json, rc.confidence, rc.successes, rc.failures
-                FROM chains_fts
-                JOIN reasoning_chains rc ON chains_fts.rowid = rc.id
-                WHERE chains_fts MATCH ?
-                AND rc.confidence >= ?
-                ORDER BY chains_fts.rank
-                LIMIT 5
-            """, (keywords, min_confidence)).fetchall()
+            best = self._conn.execute("""
+                SELECT id, steps_json, variables_json, confidence
+                FROM (
+                    SELECT rc.id, rc.intent, rc.steps_json, rc.variables_json,
+                           rc.confidence, rc.score, chains_fts.rank AS fts_rank
+                    FROM chains_fts
+                    JOIN reasoning_chains rc ON chains_fts.rowid = rc.id
+                    WHERE chains_fts MATCH ?
+                    AND rc.confidence >= ?
+                    ORDER BY chains_fts.rank
+                    LIMIT 5
+                )
+                ORDER BY intent IS ? DESC, score DESC, fts_rank
+                LIMIT 1
+            """, (keywords, min_confidence, intent or None)).fetchone()
         except Exception:
-            rows = []
-
-        # Фильтруем по intent если указан
-        if intent and rows:
-            filtered = [r for r in rows if r["intent"] == intent]
-            if filtered:
-                rows = filtered
-
-        if rows:
-            # Ранжируем
-            best = max(rows, key=lambda r: (
-                r["confidence"] * (r["successes"] / (r["failures"] + 1))
-            ))
+            best = None
 
+        if best:
             # Обновляем last_used
-            self._conn.execute(
-                "UPDATE reasoning_chains SET last_used = ? WHERE id = ?",
-                (time.time(), best["id"])
-            )
-            self._conn.commit()
+            self._touch_chain(best["id"])
 
             # Извлекаем новые переменные из текущего запроса
             new_variables = self._extract_variables(user_input, "")
-            old_variables = json.loads(best["variables_json"])
+            old_variables = _json_loads(best["variables_json"])
 
             # Подставляем новые переменные в шаги
-            steps = json.loads(best["steps_json"])
+            steps = _json_loads(best["steps_json"])
             adapted_steps = self._adapt_steps(steps, old_variables, new_variables)
 
             return {
@@ -533,6 +729,75 @@ class KnowledgeDistillation:
         # 2. Поиск по шаблонам
         return self._find_by_template(user_input, intent, min_confidence)
 
+    def _touch_chain(self, chain_id: int):
+        """Отмечает использование цепочки; в БД — пачкой раз в интервал"""
+        now = time.time()
+        self._last_used_pending[chain_id] = now
+        if now - self._pending_flushed_at >= _PENDING_FLUSH_INTERVAL:
+            self._sync_pending()
+
+    def _flush_pending(self) -> bool:
+        """
+        Пишет отложенные last_used и feedback пачками executemany.
+        Commit — у вызывающего. Возвращает True, если что-то записано.
+        """
+        self._pending_flushed_at = time.time()
+        wrote = False
+
+        if self._last_used_pending:
+            self._conn.executemany(
+                "UPDATE reasoning_chains SET last_used = ? WHERE id = ?",
+                [(ts, chain_id) for chain_id, ts in self._last_used_pending.items()]
+            )
+            self._last_used_pending.clear()
+            wrote = True
+
+        if self._feedback_pending:
+            # Одна строка на событие, порядок сохраняется: зажим
+            # MAX(0, MIN(1, c + d)) совпадает с поштучными UPDATE
+            chain_rows = []
+            template_rows = []
+            for source, item_id, useful in self._feedback_pending:
+                delta = 0.05 if useful else -0.15
+                if source == "exact":
+                    chain_rows.append((int(useful), int(not useful), delta, item_id))
+                else:
+                    template_rows.append((delta, item_id))
+            if chain_rows:
+                self._conn.executemany("""
+                    UPDATE reasoning_chains
+                    SET successes = successes + ?,
+                        failures = failures + ?,
+                        confidence = MAX(0.0, MIN(1.0, confidence + ?))
+                    WHERE id = ?
+                """, chain_rows)
+            if template_rows:
+                # У шаблонов нет счётчиков successes/failures — только confidence
+                self._conn.executemany("""
+                    UPDATE reasoning_templates
+                    SET confidence = MAX(0.0, MIN(1.0, confidence + ?))
+                    WHERE id = ?
+                """, template_rows)
+            self._feedback_pending.clear()
+            wrote = True
+
+        return wrote
+
+    def _sync_pending(self):
+        """Сбрасывает отложенные записи и коммитит, если они были"""
+        if self._flush_pending():
+            self._conn.commit()
+
+    @staticmethod
+    def _copy_reasoning(result: Dict) -> Dict:
+        """Копия для вызывающего: закэшированный результат не трогаем"""
+        copy = dict(result)
+        copy["steps"] = [dict(step) for step in result["steps"]]
+        copy["variables"] = dict(result["variables"])
+        if "original_variables" in result:
+            copy["original_variables"] = dict(result["original_variables"])
+        return copy
+
     def _find_by_template(
         self,
         user_input: str,
@@ -540,7 +805,10 @@ class KnowledgeDistillation:
         min_confidence: float = 0.6,
     ) -> Optional[Dict]:
         """Ищет подходящий шаблон рассуждений"""
-        query = "SELECT * FROM reasoning_templates WHERE confidence >= ?"
+        query = (
+            "SELECT id, confidence, example_inputs, template_steps_json "
+            "FROM reasoning_templates WHERE confidence >= ?"
+        )
         params: list = [min_confidence]
 
         if intent:
@@ -558,17 +826,24 @@ class KnowledgeDistillation:
             best_template = None
             best_sim = 0.0
 
+            # Пример → первый шаблон, где он встречается (при равном
+            # сходстве выигрывает более ранний шаблон, как и раньше).
+            # find_most_similar кодирует запрос один раз на все примеры
+            owners: Dict[str, Any] = {}
             for tpl in templates:
-                examples = json.loads(tpl["example_inputs"])
-                for example in examples:
-                    sim = self._sentence.similarity(user_input, example)
-                    if sim > best_sim:
-                        best_sim = sim
-                        best_template = tpl
+                for example in _json_loads(tpl["example_inputs"]):
+                    owners.setdefault(example, tpl)
+
+            ranked = self._sentence.find_most_similar(
+                user_input, list(owners), top_n=1
+            )
+            if ranked and ranked[0][1] > 0.0:
+                best_template = owners[ranked[0][0]]
+                best_sim = ranked[0][1]
 
             if best_template and best_sim >= 0.5:
                 new_variables = self._extract_variables(user_input, "")
-                steps = json.loads(best_template["template_steps_json"])
+                steps = _json_loads(best_template["template_steps_json"])
                 adapted = self._adapt_template_steps(steps, new_variables)
 
                 return {
@@ -583,7 +858,7 @@ class KnowledgeDistillation:
             if templates:
                 tpl = templates[0]
                 new_variables = self._extract_variables(user_input, "")
-                steps = json.loads(tpl["template_steps_json"])
+                steps = _json_loads(tpl["template_steps_json"])
                 adapted = self._adapt_template_steps(steps, new_variables)
 
                 return {
@@ -603,12 +878,17 @@ class KnowledgeDistillation:
         new_vars: Dict[str, str],
     ) -> List[Dict]:
         """Адаптирует конкретные шаги: заменяет старые переменные на новые"""
+        # Пары (старое, новое) — один раз на цепочку; неизменившиеся
+        # значения пропускаем: replace(x, x) ничего не меняет
+        replacements = [
+            (old_val, new_vars[var_name])
+            for var_name, old_val in old_vars.items()
+            if var_name in new_vars and new_vars[var_name] != old_val
+        ]
         adapted = []
         for step in steps:
             text = step["text"]
-            for var_name in old_vars:
-                old_val = old_vars[var_name]
-                new_val = new_vars.get(var_name, old_val)
+            for old_val, new_val in replacements:
                 text = text.replace(old_val, new_val)
             adapted.append({**step, "text": text})
         return adapted
@@ -619,11 +899,18 @@ class KnowledgeDistillation:
         variables: Dict[str, str],
     ) -> List[Dict]:
         """Подставляет переменные в шаблонные шаги"""
+        # "{name}" строим один раз на вызов, а не на каждый шаг
+        replacements = [
+            ("{" + var_name + "}", var_value)
+            for var_name, var_value in variables.items()
+        ]
         adapted = []
         for step in template_steps:
             text = step["text"]
-            for var_name, var_value in variables.items():
-                text = text.replace("{" + var_name + "}", var_value)
+            # Без "{" в шаге подставлять нечего
+            if "{" in text:
+                for slot, var_value in replacements:
+                    text = text.replace(slot, var_value)
             adapted.append({**step, "text": text})
         return adapted
 
@@ -685,11 +972,10 @@ class KnowledgeDistillation:
             confidence *= 0.8
 
         # 5. Проверка на незаполненные переменные {variable}
-        import re as _re
         unfilled = 0
         for s in steps:
             text = s.get("text", "")
-            unfilled += len(_re.findall(r'\{[a-z_]+\}', text))
+            unfilled += len(_UNFILLED_VAR_RE.findall(text))
         if unfilled > 0:
             warnings.append(f"{unfilled} незаполненных переменных")
             confidence *= max(0.5, 1 - unfilled * 0.1)
@@ -697,10 +983,13 @@ class KnowledgeDistillation:
         # 6. Confidence decay: цепочки старше 30 дней получают штраф
         chain_id = chain.get("chain_id")
         if chain_id and chain.get("source") == "exact":
-            row = self._conn.execute(
-                "SELECT last_used FROM reasoning_chains WHERE id = ?",
-                (chain_id,)
-            ).fetchone()
+            if chain_id in self._last_used_pending:
+                row = {"last_used": self._last_used_pending[chain_id]}
+            else:
+                row = self._conn.execute(
+                    "SELECT last_used FROM reasoning_chains WHERE id = ?",
+                    (chain_id,)
+                ).fetchone()
             if row:
                 import time as _time
                 age_days = (_time.time() - row["last_used"]) / 86400
@@ -729,56 +1018,30 @@ class KnowledgeDistillation:
 
         useful=True  → усиливаем (confidence += 0.05)
         useful=False → ослабляем (confidence -= 0.15)
-        """
-        if source == "exact":
-            table = "reasoning_chains"
-        else:
-            table = "reasoning_templates"
-
-        if useful:
-            self._conn.execute(f"""
-                UPDATE {table}
-                SET successes = successes + 1,
-                    confidence = MIN(1.0, confidence + 0.05)
-                WHERE id = ?
-            """, (chain_id,))
-        else:
-            self._conn.execute(f"""
-                UPDATE {table}
-                SET failures = failures + 1,
-                    confidence = MAX(0.0, confidence - 0.15)
-                WHERE id = ?
-            """, (chain_id,))
 
-        self._conn.commit()
+        Запись отложенная: события копятся в памяти и пишутся одной
+        транзакцией — раз в интервал и перед любым чтением confidence.
+        """
+        self._feedback_pending.append(
+            ("exact" if source == "exact" else "template", chain_id, useful)
+        )
+        self._resolve_cache.clear()
+        if time.time() - self._pending_flushed_at >= _PENDING_FLUSH_INTERVAL:
+            self._sync_pending()
 
     # ═══════════════════════════════════════════════════════════════
     #               СТАТИСТИКА
     # ═══════════════════════════════════════════════════════════════
 
     def get_stats(self) -> Dict:
-        chains = self._conn.execute(
-            "SELECT COUNT(*) as c FROM reasoning_chains"
-        ).fetchone()["c"]
-
-        templates = self._conn.execute(
-            "SELECT COUNT(*) as c FROM reasoning_templates"
-        ).fetchone()["c"]
-
-        total_steps = 0
-        rows = self._conn.execute(
-            "SELECT steps_json FROM reasoning_chains"
-        ).fetchall()
-        for row in rows:
-            try:
-                steps = json.loads(row["steps_json"])
-                total_steps += len(steps)
-            except (json.JSONDecodeError, TypeError):
-                pass
-
-        strong_chains = self._conn.execute(
-            "SELECT COUNT(*) as c FROM reasoning_chains WHERE confidence >= 0.8"
-        ).fetchone()["c"]
+        self._sync_pending()
+        counts = self._conn.execute("""
+            SELECT COUNT(*) AS chains,
+                   COUNT(*) FILTER (WHERE confidence >= 0.8) AS strong_chains,
+                   (SELECT COUNT(*) FROM reasoning_templates) AS templates,
+                   (SELECT COUNT(*) FROM reasoning_steps) AS total_steps
+            FROM reasoning_chains
+        """).fetchone()
 
         # Уникальные intent-ы
         intents = self._conn.execute(
@@ -786,10 +1049,10 @@ class KnowledgeDistillation:
         ).fetchall()
 
         return {
-            "chains": chains,
-            "templates": templates,
-            "total_steps": total_steps,
-            "strong_chains": strong_chains,
+            "chains": counts["chains"],
+            "templates": counts["templates"],
+            "total_steps": counts["total_steps"],
+            "strong_chains": counts["strong_chains"],
             "intents": [r["intent"] for r in intents],
         }
 
@@ -808,10 +1071,17 @@ class KnowledgeDistillation:
         """Удаляет слабые и старые цепочки"""
         cutoff = time.time() - (max_age_days * 86400)
 
+        # Недавно использованные цепочки не должны попасть под cutoff,
+        # свежий feedback — учитываться в confidence
+        self._flush_pending()
         self._conn.execute("""
             DELETE FROM reasoning_chains
             WHERE confidence < ? AND last_used < ?
         """, (min_confidence, cutoff))
+        self._conn.execute("""
+            DELETE FROM reasoning_steps
+            WHERE chain_id NOT IN (SELECT id FROM reasoning_chains)
+        """)
 
         # Перестраиваем FTS
         try:
@@ -820,8 +1090,16 @@ class KnowledgeDistillation:
             pass
 
         self._conn.commit()
+        self._resolve_cache.clear()
+        # После массового удаления статистика планировщика устарела;
+        # optimize сам решает, каким таблицам нужен ANALYZE
+        self._conn.execute("PRAGMA optimize")
         logger.info("🧹 Knowledge distillation: weak chains cleaned up")
 
     def close(self):
+        self._flush_pending()
         self._conn.commit()
+        # Рекомендация SQLite: optimize перед закрытием соединения —
+        # ANALYZE только для таблиц, запросы к которым это оправдывают
+        self._conn.execute("PRAGMA optimize")
         self._conn.close()
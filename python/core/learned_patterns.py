@@ -24,14 +24,127 @@ import json
 import re
 import time
 from pathlib import Path
-from typing import Optional, Dict, List, Any, Tuple
-from collections import defaultdict
+from typing import Optional, Dict, List, Any, Set, Tuple
+from collections import OrderedDict, defaultdict
 
 from utils.logging import get_logger
 import config
 
+try:
+    import ahocorasick
+    HAS_AHOCORASICK = True
+except ImportError:
+    HAS_AHOCORASICK = False
+
 logger = get_logger("learned_patterns")
 
+# Слова для FTS5 (_extract_keywords): короткие (<= 2 символов) отсекает regex
+_WORD_RE = re.compile(r'[а-яёa-z0-9]{3,}')
+_STOP_WORDS = frozenset({
+    "я", "ты", "он", "она", "мы", "вы", "они", "мне", "мой", "твой",
+    "для", "меня", "тебя", "его", "неё",
+    "в", "на", "и", "с", "по", "от", "к", "не", "что", "это", "как",
+    "но", "а", "или", "да", "нет", "бы", "ли", "же", "вот", "так",
+    "the", "is", "are", "a", "an", "in", "on", "for", "to", "of",
+    "привет", "пожалуйста", "спасибо", "можешь",
+})
+
+# Размер LRU-кэша результатов _match_routing
+_HOT_CACHE_SIZE = 512
+
+# Отложенные last_used: сброс раз в интервал (секунды) или по размеру
+_TOUCH_FLUSH_INTERVAL = 5.0
+_TOUCH_FLUSH_SIZE = 64
+
+# Литеральный якорь slot-regex (_generate_slot_regex): экранированное
+# слово перед \s+. Без якоря в тексте regex заведомо не совпадёт
+_SLOT_ANCHOR_RE = re.compile(r'((?:\\.|[^\\()\[\]{}|.*+?^$])+)\\s\+')
+_UNESCAPE_RE = re.compile(r'\\(.)', re.DOTALL)
+
+
+# ═══════════════════════════════════════════════════════════════
+#                    СХЕМА БД
+# ═══════════════════════════════════════════════════════════════
+
+# Версия схемы в PRAGMA user_version: DDL выполняется, только если
+# версия БД ниже (новая БД или созданная до версионирования)
+_SCHEMA_VERSION = 1
+
+_SCHEMA_DDL = """
+-- ── Routing patterns: запрос → intent + agent ──
+CREATE TABLE IF NOT EXISTS routing_patterns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    pattern TEXT NOT NULL,
+    keywords TEXT NOT NULL,
+    intent TEXT NOT NULL,
+    agent TEXT NOT NULL,
+    confidence REAL DEFAULT 1.0,
+    successes INTEGER DEFAULT 1,
+    failures INTEGER DEFAULT 0,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    source TEXT DEFAULT 'llm'
+);
+
+-- ── Response patterns: intent + result_type → response template ──
+CREATE TABLE IF NOT EXISTS response_patterns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    intent TEXT NOT NULL,
+    result_type TEXT NOT NULL,
+    template TEXT NOT NULL,
+    confidence REAL DEFAULT 1.0,
+    successes INTEGER DEFAULT 1,
+    failures INTEGER DEFAULT 0,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+
+-- ── Slot patterns: intent → regex для извлечения аргументов ──
+CREATE TABLE IF NOT EXISTS slot_patterns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    intent TEXT NOT NULL,
+    slot_name TEXT NOT NULL,
+    regex_pattern TEXT NOT NULL,
+    slot_position INTEGER DEFAULT 0,
+    examples TEXT DEFAULT '[]',
+    confidence REAL DEFAULT 1.0,
+    successes INTEGER DEFAULT 1,
+    failures INTEGER DEFAULT 0,
+    created_at REAL NOT NULL
+);
+
+-- ── FTS5 для быстрого полнотекстового поиска по паттернам ──
+CREATE VIRTUAL TABLE IF NOT EXISTS routing_fts
+USING fts5(keywords, content=routing_patterns, content_rowid=id);
+
+-- Индексы
+CREATE INDEX IF NOT EXISTS idx_routing_intent ON routing_patterns(intent);
+CREATE INDEX IF NOT EXISTS idx_routing_confidence ON routing_patterns(confidence DESC);
+CREATE INDEX IF NOT EXISTS idx_response_intent ON response_patterns(intent);
+CREATE INDEX IF NOT EXISTS idx_slots_intent ON slot_patterns(intent);
+"""
+
+# Готовые UPDATE'ы по таблицам: текст запроса постоянный → кэш sqlite3
+_REINFORCE_SQL = {
+    table: f"""
+        UPDATE {table}_patterns
+        SET successes = successes + 1,
+            confidence = MIN(1.0, confidence + ?),
+            last_used = ?
+        WHERE id = ?
+    """
+    for table in ("routing", "response")
+}
+_WEAKEN_SQL = {
+    table: f"""
+        UPDATE {table}_patterns
+        SET failures = failures + 1,
+            confidence = MAX(0.0, confidence - 0.15)
+        WHERE id = ?
+    """
+    for table in ("routing", "response")
+}
+
 
 class LearnedPatterns:
     """
@@ -54,14 +167,46 @@ class LearnedPatterns:
 
         self._conn = sqlite3.connect(str(self._db_path))
         self._conn.row_factory = sqlite3.Row
+        # page_size действует только на новой БД и только до перехода в WAL
+        self._conn.execute("PRAGMA page_size=8192")
         self._conn.execute("PRAGMA journal_mode=WAL")
         self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA temp_store=MEMORY")
+        if config.config.sqlite_memory_tuning:
+            # FTS5 MATCH в find_routing — на каждом запросе:
+            # mmap и кэш страниц держат постинги в памяти
+            self._conn.execute("PRAGMA mmap_size=268435456")
+            self._conn.execute("PRAGMA cache_size=-65536")
 
         self._create_tables()
 
-        # Кэш часто используемых паттернов (в RAM для скорости)
-        self._hot_cache: Dict[str, Dict] = {}
+        # Все слова из routing keywords. FTS5 MATCH "a b c" — это AND:
+        # если хоть одного слова запроса нет в словаре, совпадений точно
+        # нет и в SQLite можно не ходить. Удаления словарь не чистят —
+        # лишнее слово стоит только обычного запроса.
+        self._routing_vocab: Set[str] = set()
+        for row in self._conn.execute("SELECT keywords FROM routing_patterns"):
+            self._routing_vocab.update(row["keywords"].split())
+
+        # Растёт при каждом изменении routing/slot паттернов —
+        # по ней потребители (IntentRouter) сбрасывают свои кэши
+        self._version = 0
+
+        # Кэш часто используемых паттернов (в RAM для скорости):
+        # (keywords, min_confidence) → (version, время, результат _match_routing).
+        # Любое изменение routing меняет _version — запись становится недействительной
+        self._hot_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
         self._cache_ttl = 300  # 5 минут
+        # intent → (version, [(slot_name, regex, якорь)], автомат якорей) для find_slots
+        self._slot_cache: Dict[str, tuple] = {}
+
+        # таблица → {id: last_used}, ещё не записанные в БД (последний
+        # выигрывает). Поиск не коммитит на каждое попадание
+        self._pending_touch: Dict[str, Dict[int, float]] = {
+            "routing_patterns": {},
+            "response_patterns": {},
+        }
+        self._touch_flushed_at = time.time()
 
         stats = self.get_stats()
         logger.info(
@@ -70,77 +215,12 @@ class LearnedPatterns:
         )
 
     def _create_tables(self):
-        """Создаёт таблицы для хранения паттернов"""
-        cur = self._conn.cursor()
-
-        # ── Routing patterns: запрос → intent + agent ──
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS routing_patterns (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                pattern TEXT NOT NULL,
-                keywords TEXT NOT NULL,
-                intent TEXT NOT NULL,
-                agent TEXT NOT NULL,
-                confidence REAL DEFAULT 1.0,
-                successes INTEGER DEFAULT 1,
-                failures INTEGER DEFAULT 0,
-                created_at REAL NOT NULL,
-                last_used REAL NOT NULL,
-                source TEXT DEFAULT 'llm'
-            )
-        """)
-
-        # ── Response patterns: intent + result_type → response template ──
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS response_patterns (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                intent TEXT NOT NULL,
-                result_type TEXT NOT NULL,
-                template TEXT NOT NULL,
-                confidence REAL DEFAULT 1.0,
-                successes INTEGER DEFAULT 1,
-                failures INTEGER DEFAULT 0,
-                created_at REAL NOT NULL,
-                last_used REAL NOT NULL
-            )
-        """)
-
-        # ── Slot patterns: intent → regex для извлечения аргументов ──
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS slot_patterns (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                intent TEXT NOT NULL,
-                slot_name TEXT NOT NULL,
-                regex_pattern TEXT NOT NULL,
-                slot_position INTEGER DEFAULT 0,
-                examples TEXT DEFAULT '[]',
-                confidence REAL DEFAULT 1.0,
-                successes INTEGER DEFAULT 1,
-                failures INTEGER DEFAULT 0,
-                created_at REAL NOT NULL
-            )
-        """)
-
-        # ── FTS5 для быстрого полнотекстового поиска по паттернам ──
-        cur.execute("""
-            CREATE VIRTUAL TABLE IF NOT EXISTS routing_fts
-            USING fts5(keywords, content=routing_patterns, content_rowid=id)
-        """)
-
-        # Индексы
-        cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_routing_intent ON routing_patterns(intent)
-        """)
-        cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_routing_confidence ON routing_patterns(confidence DESC)
-        """)
-        cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_response_intent ON response_patterns(intent)
-        """)
-        cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_slots_intent ON slot_patterns(intent)
-        """)
-
+        """Создаёт таблицы для хранения паттернов, если схема БД устарела"""
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= _SCHEMA_VERSION:
+            return
+        self._conn.executescript(_SCHEMA_DDL)
+        self._conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
         self._conn.commit()
 
     # ═══════════════════════════════════════════════════════════════
@@ -186,6 +266,8 @@ class LearnedPatterns:
         """, (rowid, keywords))
 
         self._conn.commit()
+        self._routing_vocab.update(keywords.split())
+        self._version += 1
         logger.debug(f"📝 Learned routing: '{user_input[:50]}' → {intent} ({agent})")
 
     def learn_response(
@@ -232,39 +314,54 @@ class LearnedPatterns:
         → slot "filepath": regex=r'файл\s+([\w.]+)', value="wishes.txt"
         → slot "content": regex=r'с\s+(.+)$', value="пожеланиями"
         """
+        # Генерируем regex из примеров: (slot_name, regex, value)
+        candidates = []
         for slot_name, slot_value in extracted_args.items():
             if not slot_value or not isinstance(slot_value, str):
                 continue
-
-            # Генерируем regex из примера
             regex = self._generate_slot_regex(user_input, slot_value, slot_name)
-            if not regex:
-                continue
-
-            # Проверяем дубликат
-            existing = self._conn.execute("""
-                SELECT id FROM slot_patterns
-                WHERE intent = ? AND slot_name = ? AND regex_pattern = ?
-            """, (intent, slot_name, regex)).fetchone()
-
-            if existing:
-                self._conn.execute("""
+            if regex:
+                candidates.append((slot_name, regex, slot_value))
+
+        if candidates:
+            # Дубликаты — одним SELECT на все слоты (первый id, как fetchone)
+            regexes = list({regex for _, regex, _ in candidates})
+            placeholders = ", ".join("?" * len(regexes))
+            existing: Dict[Tuple[str, str], int] = {}
+            for row in self._conn.execute(f"""
+                SELECT id, slot_name, regex_pattern FROM slot_patterns
+                WHERE intent = ? AND regex_pattern IN ({placeholders})
+            """, (intent, *regexes)):
+                existing.setdefault((row["slot_name"], row["regex_pattern"]), row["id"])
+
+            updates = []
+            inserts = []
+            now = time.time()
+            for slot_name, regex, slot_value in candidates:
+                pattern_id = existing.get((slot_name, regex))
+                if pattern_id is not None:
+                    updates.append((pattern_id,))
+                else:
+                    examples = json.dumps([{
+                        "input": user_input,
+                        "value": str(slot_value),
+                    }], ensure_ascii=False)
+                    inserts.append((intent, slot_name, regex, examples, now))
+
+            if updates:
+                self._conn.executemany("""
                     UPDATE slot_patterns SET successes = successes + 1
                     WHERE id = ?
-                """, (existing["id"],))
-            else:
-                examples = json.dumps([{
-                    "input": user_input,
-                    "value": str(slot_value),
-                }], ensure_ascii=False)
-
-                self._conn.execute("""
+                """, updates)
+            if inserts:
+                self._conn.executemany("""
                     INSERT INTO slot_patterns
                     (intent, slot_name, regex_pattern, examples, created_at)
                     VALUES (?, ?, ?, ?, ?)
-                """, (intent, slot_name, regex, examples, time.time()))
+                """, inserts)
 
         self._conn.commit()
+        self._version += 1
 
     # ═══════════════════════════════════════════════════════════════
     #              ИСПОЛЬЗОВАНИЕ (ПОИСК ПАТТЕРНОВ)
@@ -277,51 +374,93 @@ class LearnedPatterns:
         Возвращает None если не нашёл (→ нужен LLM).
         Возвращает Dict если нашёл (→ LLM не нужен).
         """
+        result = self._match_routing(user_input, min_confidence)
+        if result:
+            # Обновляем last_used
+            self._touch("routing_patterns", result["pattern_id"])
+        return result
+
+    def find_routing_bulk(
+        self, inputs: List[str], min_confidence: float = 0.6,
+    ) -> List[Optional[Dict]]:
+        """
+        find_routing для списка запросов (офлайн-разметка, бэкфилл).
+
+        Поиск — тот же, по запросу на строку; last_used всех найденных
+        паттернов (и отложенных ранее) пишется одним commit.
+        """
+        results = [self._match_routing(text, min_confidence) for text in inputs]
+        now = time.time()
+        pending = self._pending_touch["routing_patterns"]
+        for r in results:
+            if r:
+                pending[r["pattern_id"]] = now
+        if pending:
+            self._flush_touches()
+            self._conn.commit()
+        return results
+
+    def _match_routing(self, user_input: str, min_confidence: float) -> Optional[Dict]:
+        """Поиск лучшего routing паттерна без обновления last_used"""
+        # Ключевое слово — от 3 символов (_WORD_RE): короче искать нечего
+        if len(user_input) < 3:
+            return None
+
         keywords = self._extract_keywords(user_input)
         if not keywords:
             return None
 
-        # 1. Поиск через FTS5 (быстрый полнотекстовый)
-        try:
-            rows = self._conn.execute("""
-                SELECT rp.id, rp.pattern, rp.intent, rp.agent,
-                       rp.confidence, rp.successes, rp.failures,
-                       routing_fts.rank
-                FROM routing_fts
-                JOIN routing_patterns rp ON routing_fts.rowid = rp.id
-                WHERE routing_fts MATCH ?
-                AND rp.confidence >= ?
-                ORDER BY routing_fts.rank
-                LIMIT 5
-            """, (keywords, min_confidence)).fetchall()
-        except Exception:
-            rows = []
-
-        if not rows:
+        # Результат зависит только от keywords — разные формулировки
+        # с одинаковыми словами делят запись кэша
+        key = (keywords, min_confidence)
+        now = time.time()
+        cached = self._hot_cache.get(key)
+        if (cached is not None and cached[0] == self._version
+                and now - cached[1] < self._cache_ttl):
+            self._hot_cache.move_to_end(key)
+            return dict(cached[2]) if cached[2] is not None else None
+
+        result = self._match_keywords(keywords, min_confidence)
+        self._hot_cache[key] = (self._version, now, result)
+        self._hot_cache.move_to_end(key)
+        if len(self._hot_cache) > _HOT_CACHE_SIZE:
+            self._hot_cache.popitem(last=False)
+        return dict(result) if result is not None else None
+
+    def _match_keywords(self, keywords: str, min_confidence: float) -> Optional[Dict]:
+        """FTS5-поиск и ранжирование по уже извлечённым keywords"""
+        # 0. Слова, которого нет ни в одном паттерне → FTS5 ничего не найдёт
+        if not self._routing_vocab.issuperset(keywords.split()):
             return None
 
-        # 2. Ранжируем: confidence * successes / (failures + 1) * FTS_score
-        best = None
-        best_score = 0
-
-        for row in rows:
-            score = (
-                row["confidence"]
-                * (row["successes"] / (row["failures"] + 1))
-            )
-            if score > best_score:
-                best_score = score
-                best = dict(row)
+        # 1. Поиск через FTS5 (быстрый полнотекстовый): топ-5 по rank,
+        # 2. среди них — лучший по confidence * successes / (failures + 1);
+        #    при равенстве выигрывает лучший rank, нулевой score не берём
+        try:
+            best = self._conn.execute("""
+                SELECT id, intent, agent, confidence
+                FROM (
+                    SELECT rp.id, rp.intent, rp.agent, rp.confidence,
+                           rp.confidence * (CAST(rp.successes AS REAL) / (rp.failures + 1))
+                               AS score,
+                           routing_fts.rank AS fts_rank
+                    FROM routing_fts
+                    JOIN routing_patterns rp ON routing_fts.rowid = rp.id
+                    WHERE routing_fts MATCH ?
+                    AND rp.confidence >= ?
+                    ORDER BY routing_fts.rank
+                    LIMIT 5
+                )
+                WHERE score > 0
+                ORDER BY score DESC, fts_rank
+                LIMIT 1
+            """, (keywords, min_confidence)).fetchone()
+        except Exception:
+            best = None
 
         if not best:
             return None
 
-        # 3. Обновляем last_used
-        self._conn.execute("""
-            UPDATE routing_patterns SET last_used = ? WHERE id = ?
-        """, (time.time(), best["id"]))
-        self._conn.commit()
-
         return {
             "intent": best["intent"],
             "agent": best["agent"],
@@ -356,10 +495,7 @@ class LearnedPatterns:
             response = row["template"].replace("{result}", tool_result)
 
         # Обновляем last_used
-        self._conn.execute("""
-            UPDATE response_patterns SET last_used = ? WHERE id = ?
-        """, (time.time(), row["id"]))
-        self._conn.commit()
+        self._touch("response_patterns", row["id"])
 
         return response
 
@@ -369,23 +505,66 @@ class LearnedPatterns:
 
         Возвращает {"filepath": "wishes.txt", "content": "..."} или {}
         """
+        compiled, automaton = self._compiled_slots(intent)
+        text = user_input.lower()
+        # Один проход Ахо-Корасик находит все якоря, встречающиеся в тексте
+        found = {anchor for _, anchor in automaton.iter(text)} if automaton else None
+
+        slots = {}
+        for slot_name, pattern, anchor in compiled:
+            if anchor is not None and (
+                anchor not in found if found is not None else anchor not in text
+            ):
+                continue
+            match = pattern.search(user_input)
+            if match:
+                value = match.group(1) if match.groups() else match.group(0)
+                slots[slot_name] = value
+
+        return slots
+
+    def _compiled_slots(self, intent: str) -> Tuple[list, Any]:
+        """
+        Скомпилированные slot-regex для intent (до смены версии).
+
+        Возвращает ([(slot_name, regex, якорь или None)], автомат якорей).
+        Якорь — литерал в нижнем регистре; автомат есть только при
+        pyahocorasick и хотя бы одном якоре, иначе None.
+        """
+        cached = self._slot_cache.get(intent)
+        if cached is not None and cached[0] == self._version:
+            return cached[1], cached[2]
+
+        # Курсор читаем построчно — список строк не нужен
         rows = self._conn.execute("""
             SELECT slot_name, regex_pattern FROM slot_patterns
             WHERE intent = ? AND confidence >= 0.5
             ORDER BY successes DESC
-        """, (intent,)).fetchall()
+        """, (intent,))
 
-        slots = {}
+        compiled = []
         for row in rows:
             try:
-                match = re.search(row["regex_pattern"], user_input, re.IGNORECASE)
-                if match:
-                    value = match.group(1) if match.groups() else match.group(0)
-                    slots[row["slot_name"]] = value
+                pattern = re.compile(row["regex_pattern"], re.IGNORECASE)
             except re.error:
                 continue
+            anchor_match = _SLOT_ANCHOR_RE.match(row["regex_pattern"])
+            anchor = (
+                _UNESCAPE_RE.sub(r"\1", anchor_match.group(1)).lower()
+                if anchor_match else None
+            )
+            compiled.append((row["slot_name"], pattern, anchor))
 
-        return slots
+        automaton = None
+        anchors = {anchor for _, _, anchor in compiled if anchor is not None}
+        if HAS_AHOCORASICK and anchors:
+            automaton = ahocorasick.Automaton()
+            for anchor in anchors:
+                automaton.add_word(anchor, anchor)
+            automaton.make_automaton()
+
+        self._slot_cache[intent] = (self._version, compiled, automaton)
+        return compiled, automaton
 
     # ═══════════════════════════════════════════════════════════════
     #              ОБРАТНАЯ СВЯЗЬ (УСИЛЕНИЕ / ОСЛАБЛЕНИЕ)
@@ -393,26 +572,15 @@ class LearnedPatterns:
 
     def reinforce(self, pattern_id: int, table: str = "routing"):
         """Паттерн сработал правильно → усиливаем"""
-        tbl = "routing_patterns" if table == "routing" else "response_patterns"
-        self._conn.execute(f"""
-            UPDATE {tbl}
-            SET successes = successes + 1,
-                confidence = MIN(1.0, confidence + 0.05),
-                last_used = ?
-            WHERE id = ?
-        """, (time.time(), pattern_id))
-        self._conn.commit()
+        self._bump(table, pattern_id, 0.05)
+        self._version += 1
 
     def weaken(self, pattern_id: int, table: str = "routing"):
         """Паттерн сработал неправильно → ослабляем"""
-        tbl = "routing_patterns" if table == "routing" else "response_patterns"
-        self._conn.execute(f"""
-            UPDATE {tbl}
-            SET failures = failures + 1,
-                confidence = MAX(0.0, confidence - 0.15)
-            WHERE id = ?
-        """, (pattern_id,))
+        key = "routing" if table == "routing" else "response"
+        self._conn.execute(_WEAKEN_SQL[key], (pattern_id,))
         self._conn.commit()
+        self._version += 1
 
     # ═══════════════════════════════════════════════════════════════
     #              ВНУТРЕННИЕ МЕТОДЫ
@@ -420,18 +588,7 @@ class LearnedPatterns:
 
     def _extract_keywords(self, text: str) -> str:
         """Извлекает ключевые слова для FTS5 поиска"""
-        stop_words = {
-            "я", "ты", "он", "она", "мы", "вы", "они", "мне", "мой", "твой",
-            "для", "меня", "тебя", "его", "неё",
-            "в", "на", "и", "с", "по", "от", "к", "не", "что", "это", "как",
-            "но", "а", "или", "да", "нет", "бы", "ли", "же", "вот", "так",
-            "the", "is", "are", "a", "an", "in", "on", "for", "to", "of",
-            "привет", "пожалуйста", "спасибо", "можешь",
-        }
-        words = []
-        for word in re.findall(r'[а-яёa-z0-9]+', text.lower()):
-            if len(word) > 2 and word not in stop_words:
-                words.append(word)
+        words = [w for w in _WORD_RE.findall(text.lower()) if w not in _STOP_WORDS]
         return " ".join(words[:15])
 
     def _find_similar_routing(self, keywords: str, intent: str) -> Optional[Dict]:
@@ -457,27 +614,44 @@ class LearnedPatterns:
         """, (intent, result_type)).fetchone()
         return dict(row) if row else None
 
+    def _bump(self, table: str, pattern_id: int, step: float):
+        """successes+1, confidence+step, last_used=now — и commit"""
+        key = "routing" if table == "routing" else "response"
+        # Отложенный last_used старше — не должен затереть новый
+        self._flush_touches()
+        self._conn.execute(_REINFORCE_SQL[key],
+                           (step, time.time(), pattern_id))
+        self._conn.commit()
+
     def _reinforce_routing(self, pattern_id: int):
         """Усиливает routing паттерн"""
-        self._conn.execute("""
-            UPDATE routing_patterns
-            SET successes = successes + 1,
-                confidence = MIN(1.0, confidence + 0.03),
-                last_used = ?
-            WHERE id = ?
-        """, (time.time(), pattern_id))
-        self._conn.commit()
+        self._bump("routing", pattern_id, 0.03)
+        self._version += 1
 
     def _reinforce_response(self, pattern_id: int):
         """Усиливает response паттерн"""
-        self._conn.execute("""
-            UPDATE response_patterns
-            SET successes = successes + 1,
-                confidence = MIN(1.0, confidence + 0.03),
-                last_used = ?
-            WHERE id = ?
-        """, (time.time(), pattern_id))
-        self._conn.commit()
+        self._bump("response", pattern_id, 0.03)
+
+    def _touch(self, table: str, pattern_id: int):
+        """Отмечает использование паттерна; в БД — пачкой"""
+        now = time.time()
+        pending = self._pending_touch[table]
+        pending[pattern_id] = now
+        if (now - self._touch_flushed_at >= _TOUCH_FLUSH_INTERVAL
+                or len(pending) >= _TOUCH_FLUSH_SIZE):
+            self._flush_touches()
+            self._conn.commit()
+
+    def _flush_touches(self):
+        """Пишет отложенные last_used executemany по таблицам (commit — у вызывающего)"""
+        self._touch_flushed_at = time.time()
+        for table, pending in self._pending_touch.items():
+            if pending:
+                self._conn.executemany(
+                    f"UPDATE {table} SET last_used = ? WHERE id = ?",
+                    [(ts, pattern_id) for pattern_id, ts in pending.items()]
+                )
+                pending.clear()
 
     def _classify_result(self, result: str) -> str:
         """Классифицирует результат: success / error / empty"""
@@ -512,14 +686,18 @@ class LearnedPatterns:
         Пример: input="удали файл test.py", value="test.py"
         → regex: r'файл\s+([\w.]+)'
         """
-        escaped_value = re.escape(slot_value)
-
-        # Находим позицию значения в тексте
-        match = re.search(escaped_value, user_input, re.IGNORECASE)
-        if not match:
-            return None
-
-        start = match.start()
+        # Находим позицию значения в тексте (без учёта регистра)
+        lowered = user_input.lower()
+        if len(lowered) == len(user_input):
+            start = lowered.find(slot_value.lower())
+            if start < 0:
+                return None
+        else:
+            # lower() сдвинул позиции (напр. «İ» → 2 символа) — через regex
+            match = re.search(re.escape(slot_value), user_input, re.IGNORECASE)
+            if not match:
+                return None
+            start = match.start()
 
         # Берём 1-2 слова перед значением как контекст
         prefix = user_input[:start].strip()
@@ -548,25 +726,19 @@ class LearnedPatterns:
 
     def get_stats(self) -> Dict[str, int]:
         """Статистика базы паттернов"""
-        routing = self._conn.execute(
-            "SELECT COUNT(*) as c FROM routing_patterns"
-        ).fetchone()["c"]
-        response = self._conn.execute(
-            "SELECT COUNT(*) as c FROM response_patterns"
-        ).fetchone()["c"]
-        slots = self._conn.execute(
-            "SELECT COUNT(*) as c FROM slot_patterns"
-        ).fetchone()["c"]
-
-        high_conf = self._conn.execute(
-            "SELECT COUNT(*) as c FROM routing_patterns WHERE confidence >= 0.8"
-        ).fetchone()["c"]
+        row = self._conn.execute("""
+            SELECT COUNT(*) AS routing,
+                   COUNT(*) FILTER (WHERE confidence >= 0.8) AS high_confidence,
+                   (SELECT COUNT(*) FROM response_patterns) AS response,
+                   (SELECT COUNT(*) FROM slot_patterns) AS slots
+            FROM routing_patterns
+        """).fetchone()
 
         return {
-            "routing": routing,
-            "response": response,
-            "slots": slots,
-            "high_confidence": high_conf,
+            "routing": row["routing"],
+            "response": row["response"],
+            "slots": row["slots"],
+            "high_confidence": row["high_confidence"],
         }
 
     def get_coverage_report(self) -> str:
@@ -591,18 +763,49 @@ class LearnedPatterns:
         """Удаляет слабые и старые паттерны"""
         cutoff = time.time() - (max_age_days * 86400)
 
-        for table in ["routing_patterns", "response_patterns", "slot_patterns"]:
-            self._conn.execute(f"""
-                DELETE FROM {table}
+        params = (min_confidence, cutoff)
+
+        # Одна транзакция: commit в конце, rollback при ошибке
+        with self._conn:
+            # Недавно использованные паттерны не должны попасть под cutoff
+            self._flush_touches()
+
+            # routing_fts — external content: удаляемые строки убираем из
+            # индекса точечно ('delete' со старыми keywords) вместо rebuild
+            doomed = self._conn.execute("""
+                SELECT id, keywords FROM routing_patterns
                 WHERE confidence < ? AND last_used < ?
-            """, (min_confidence, cutoff) if "last_used" in table else (min_confidence, cutoff))
+            """, params).fetchall()
+            self._conn.executemany("""
+                INSERT INTO routing_fts (routing_fts, rowid, keywords)
+                VALUES ('delete', ?, ?)
+            """, [(row["id"], row["keywords"]) for row in doomed])
+
+            self._conn.execute("""
+                DELETE FROM routing_patterns
+                WHERE confidence < ? AND last_used < ?
+            """, params)
+            self._conn.execute("""
+                DELETE FROM response_patterns
+                WHERE confidence < ? AND last_used < ?
+            """, params)
+            # У slot_patterns нет last_used — возраст по created_at
+            self._conn.execute("""
+                DELETE FROM slot_patterns
+                WHERE confidence < ? AND created_at < ?
+            """, params)
 
-        # Перестраиваем FTS
-        self._conn.execute("INSERT INTO routing_fts(routing_fts) VALUES('rebuild')")
-        self._conn.commit()
+        self._version += 1
 
         logger.info("🧹 Weak patterns cleaned up")
 
+    @property
+    def version(self) -> int:
+        """Счётчик изменений routing/slot паттернов"""
+        return self._version
+
     def close(self):
         """Закрытие соединения с БД"""
+        self._flush_touches()
+        self._conn.commit()
         self._conn.close()
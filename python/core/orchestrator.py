@@ -310,7 +310,7 @@ class Orchestrator:
                 logger.debug(f"CrossAttention enrichment skipped: {e}")
 
             # === ШАГ 2: ЧЕТЫРЁХУРОВНЕВЫЙ РОУТИНГ (v7.2) ===
-            route = self.intent_router.route(user_input)
+            route = await self.intent_router.route_async(user_input)
 
             # v7.2: Оценка уверенности (ActiveLearning)
             assessment = self.active_learning.assess_confidence(